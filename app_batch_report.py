@@ -0,0 +1,180 @@
+# Batch report feature of app
+# Evaluates several hazard map layers (e.g., flood, landslide and ashfall) against the student data at once.
+
+import io
+
+import streamlit as st
+import pandas as pd
+
+from app_gadm_index import get_gid_index
+from app_export import download_table
+from app_hazard_layer import HazardLayer, affected_matrix, read_layer_csv
+
+@st.cache_resource(max_entries = 50)
+def get_uploaded_layer(finest_level, file_bytes, _gid_index):
+    """Read an uploaded layer CSV file into a HazardLayer. Each file is only read once, so reruns (e.g., after changing a widget) do not read every file again.
+Returns a tuple of (layer, number of rejected rows). The layer is shared by every session that uploads the same file, so it must not be changed.
+The _gid_index parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+    layer = HazardLayer(_gid_index)
+    n_added, n_duplicates, rejected_df, n_rejected = read_layer_csv(layer, io.BytesIO(file_bytes))
+
+    result = (layer, n_rejected)
+    return result
+
+def batch_report_feature(finest_level, gdf, students_df, data_version):
+    """Generates one combined report about the students affected by each of several hazards.
+    data_version identifies the current student data, so that results are only recomputed when the data or the layers change."""
+
+    st.markdown("# Batch Report")
+    st.markdown("Upload several hazard map layers made with the Hazard Map Layer Creator. The report will have one column per hazard, indicating whether each student is affected by it.")
+
+    # Label of finest level.
+    finest_label = f"GID_{finest_level}"
+
+    gid_index = get_gid_index(finest_level, gdf)
+
+    uploaded_files = st.file_uploader(
+        "Select Files (CSV)",
+        type = "csv",
+        accept_multiple_files = True,
+    )
+
+    include_session_layer = st.checkbox(
+        "Also include the layer from the Hazard Map Layer Creator",
+        value = False,
+        disabled = ("layer" not in st.session_state) or (len(st.session_state.layer) == 0),
+    )
+
+    # Names of the hazards and their layers, in the same order.
+    hazard_names = []
+    layers = []
+
+    if include_session_layer:
+        hazard_names.append("current_layer")
+        layers.append(st.session_state.layer)
+
+    for uploaded_file in uploaded_files:
+        try:
+            layer, n_rejected = get_uploaded_layer(finest_level, uploaded_file.getvalue(), gid_index)
+        except ValueError:
+            st.warning(f"The format of {uploaded_file.name} is invalid, so it was skipped.")
+            continue
+
+        if n_rejected > 0:
+            st.warning(f"{n_rejected} entries of {uploaded_file.name} have an invalid level or GID, so they were skipped.")
+
+        # The hazard is named after the file. If the name is already taken (including by the "Any hazard" row of the statistics), a number is added at the end.
+        base_name = uploaded_file.name.rsplit(".", 1)[0]
+        hazard_name = base_name
+        number = 2
+        while (hazard_name in hazard_names) or (hazard_name == "Any hazard"):
+            hazard_name = f"{base_name}_{number}"
+            number += 1
+
+        hazard_names.append(hazard_name)
+        layers.append(layer)
+
+    if len(layers) == 0:
+        st.warning("No hazard map layers have been uploaded yet.")
+        st.stop()
+
+    @st.cache_data(ttl = None)
+    def identify_affected_batch(finest_label, data_version, layer_keys, hazard_names, _students_df, _layers, _gid_index):
+        """Obtain a DF of all students with one boolean column per hazard, True if the student's area is covered by that hazard's layer.
+        All layers are evaluated in a single pass over the students. layer_keys identify the areas covered by each layer, so the result is cached per version of the student data and set of layers without hashing the roster itself.
+        The _students_df, _layers and _gid_index parameters have a leading underscore so that they are not hashed by st.cache_data()."""
+
+        student_info_cols = [
+            "strand",
+            "grade_level",
+            "section",
+            "student_number",
+        ]
+
+        affected_df = (
+            _students_df
+            .loc[
+                :,
+                student_info_cols + [finest_label]
+            ]
+            # Sort rows
+            .sort_values(by = student_info_cols)
+            .reset_index(drop = True)
+        )
+
+        matrix = affected_matrix(_gid_index, _layers, affected_df[finest_label])
+
+        matrix_df = pd.DataFrame(
+            matrix,
+            columns = hazard_names,
+        )
+
+        result = pd.concat(
+            [affected_df[student_info_cols], matrix_df],
+            axis = 1,
+        )
+        return result
+
+    affected_df = identify_affected_batch(
+        finest_label,
+        data_version,
+        tuple(layer.key() for layer in layers),
+        hazard_names,
+        students_df,
+        layers,
+        gid_index,
+    )
+
+    # Students affected by at least one hazard
+    any_affected = affected_df[hazard_names].any(axis = 1)
+
+    st.markdown("## Main Statistics")
+
+    number_affected = affected_df[hazard_names].sum(axis = 0)
+    number_affected["Any hazard"] = any_affected.sum()
+
+    stats_df = pd.DataFrame(
+        {
+            "Number of ASHS Students Affected": number_affected,
+            "Percentage of ASHS Students Affected": (number_affected / affected_df.shape[0] * 100).round(2),
+        }
+    )
+    stats_df.index.name = "Hazard"
+
+    st.dataframe(stats_df)
+
+    if not any_affected.any():
+        st.warning("No students are affected by these hazards, so a report has not been generated.")
+        st.stop()
+
+    st.markdown("## Table of Affected Students")
+
+    # Column of Yes or No strings for each hazard
+    save_df = affected_df.copy()
+    save_df[hazard_names] = save_df[hazard_names].replace({True: "Yes", False: "No"})
+
+    display_df = (
+        save_df
+        # Only display students affected by at least one hazard
+        .loc[any_affected]
+        .reset_index(drop = True)
+    )
+    display_df["student_number"] = display_df["student_number"].astype(str)
+
+    st.dataframe(display_df)
+
+    # Let the user save the table.
+    st.markdown("## Save Table")
+    st.markdown("Note that the table shown above includes only students affected by at least one hazard. On the other hand, the table that is downloaded will include all ASHS students, with one column per hazard.\n\nThe CSV file is a text file that can be opened in Excel as a spreadsheet. For large reports, the compressed CSV and Parquet files are much smaller. The Excel file has one sheet per strand and grade level.")
+
+    filename = st.text_input(
+        "Filename (without extension)",
+        value = "batch_hazard_mapping_results",
+    )
+
+    download_table(
+        save_df,
+        filename,
+        "Download complete table",
+        key = "export format - batch report",
+    )
@@ -0,0 +1,143 @@
+# Downloadable tables of the app.
+# st.download_button() needs the whole file as bytes, so every file is built in one in-memory buffer. CSV text is written into it a chunk of rows at a time, so there is no full-size string next to the buffer.
+# Tables can also be compressed or saved as Parquet or Excel files, which are much smaller for large reports.
+
+import io
+import re
+import gzip
+
+import streamlit as st
+import pandas as pd
+
+# Number of rows written at a time.
+export_chunk_size = 10000
+
+# File extension and MIME type of each download format.
+export_formats = {
+    "CSV": (".csv", "text/csv"),
+    "Compressed CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Columns that split an Excel file into sheets.
+default_sheet_cols = ("strand", "grade_level")
+
+# Sheet names can have at most 31 characters, and none of these characters.
+max_sheet_name_length = 31
+invalid_sheet_name_chars = re.compile(r"[\[\]:*?/\\]")
+
+def write_csv(df, file, chunk_size = export_chunk_size):
+    """Write a DataFrame to a binary file as UTF-8 CSV, one chunk of rows at a time. Only one chunk's text exists at any time, besides what is already in the file."""
+    for start in range(0, max(df.shape[0], 1), chunk_size):
+        text = df.iloc[start:start + chunk_size].to_csv(
+            index = False,
+            # The header is only written once.
+            header = (start == 0),
+        )
+        file.write(text.encode("utf-8"))
+
+def to_csv_bytes(df, compress = False):
+    """CSV file of a DataFrame as bytes, optionally compressed with gzip. The whole file is held in memory."""
+    buffer = io.BytesIO()
+
+    if compress:
+        with gzip.GzipFile(fileobj = buffer, mode = "wb") as file:
+            write_csv(df, file)
+    else:
+        write_csv(df, buffer)
+
+    result = buffer.getvalue()
+    return result
+
+def to_parquet_bytes(df):
+    """Parquet file of a DataFrame as bytes. Parquet is compressed and keeps column types, so it is best for large tables that are analyzed in Python or R."""
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index = False)
+
+    result = buffer.getvalue()
+    return result
+
+def make_sheet_name(keys, used_names):
+    """Valid, unique Excel sheet name for a group of rows, e.g., "STEM 11" for strand STEM and grade level 11.
+Invalid characters are replaced with "-". If the name is already in used_names (e.g., two names that are the same after being shortened), a number is added at the end."""
+    name = " ".join(str(key) for key in keys)
+    # Sheet names also cannot start or end with an apostrophe.
+    name = invalid_sheet_name_chars.sub("-", name).strip("'")
+    if name == "":
+        name = "Sheet"
+
+    result = name[:max_sheet_name_length]
+    number = 2
+    while result.lower() in used_names:
+        suffix = f" ({number})"
+        result = name[:max_sheet_name_length - len(suffix)] + suffix
+        number += 1
+
+    # Excel compares sheet names without regard to case.
+    used_names.add(result.lower())
+    return result
+
+def has_sheet_cols(df, sheet_cols = default_sheet_cols):
+    """Whether a DataFrame is split into several sheets in its Excel file."""
+    result = set(sheet_cols).issubset(df.columns)
+    return result
+
+def to_xlsx_bytes(df, sheet_cols = default_sheet_cols):
+    """Excel file of a DataFrame as bytes, with one sheet per combination of the sheet_cols columns (e.g., one sheet per strand and grade level).
+If the DataFrame does not have all of the sheet_cols columns, everything is put in one sheet."""
+    buffer = io.BytesIO()
+
+    with pd.ExcelWriter(buffer, engine = "openpyxl") as writer:
+        if has_sheet_cols(df, sheet_cols):
+            used_names = set()
+            for keys, sheet_df in df.groupby(list(sheet_cols), sort = True, dropna = False):
+                sheet_df.to_excel(writer, sheet_name = make_sheet_name(keys, used_names), index = False)
+        else:
+            df.to_excel(writer, sheet_name = "Sheet1", index = False)
+
+    result = buffer.getvalue()
+    return result
+
+@st.cache_data(ttl = None, max_entries = 10)
+def convert_df_for_download(df, export_format = "CSV"):
+    """Convert a dataframe so that it can be downloaded using st.download_button().
+export_format is one of the keys of export_formats.
+st.cache_data hashes the DataFrame on every call and keeps a copy of each file's bytes, so a rerun does not build the file again. At most 10 files are kept."""
+    if export_format == "CSV":
+        result = to_csv_bytes(df)
+    elif export_format == "Compressed CSV (gzip)":
+        result = to_csv_bytes(df, compress = True)
+    elif export_format == "Parquet":
+        result = to_parquet_bytes(df)
+    else:
+        result = to_xlsx_bytes(df)
+
+    return result
+
+def download_table(df, filename, label, key):
+    """Let the user choose a format and download a table in it.
+filename has no extension. The key keeps the format choices of different tables apart."""
+    if has_sheet_cols(df):
+        excel_label = "Excel (one sheet per strand and grade level)"
+        excel_help = " The Excel file has one sheet per strand and grade level."
+    else:
+        excel_label = "Excel"
+        excel_help = ""
+
+    export_format = st.selectbox(
+        "File format",
+        options = list(export_formats),
+        format_func = lambda option: excel_label if option == "Excel" else option,
+        key = key,
+        help = "Compressed CSV and Parquet files are much smaller for large tables." + excel_help,
+    )
+
+    extension, mime = export_formats[export_format]
+
+    st.download_button(
+        label,
+        data = convert_df_for_download(df, export_format),
+        file_name = f"{filename}{extension}",
+        mime = mime,
+    )
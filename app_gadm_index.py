@@ -0,0 +1,106 @@
+# Lookup tables over the GADM table.
+# They are built once per process with st.cache_resource and shared by every session, so features do not have to scan the GADM table on every rerun.
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+
+class GidIndex:
+    """Dense integer codes of the finest-level areas.
+The code of an area is its row position in the GADM table, so a set of areas can be stored as a boolean array (bitmap) with one element per finest-level area.
+Also holds the codes of the finest-level areas inside every coarse area (e.g., the barangays of a province)."""
+
+    def __init__(self, finest_level, gdf):
+        self.finest_level = finest_level
+
+        finest_label = f"GID_{finest_level}"
+
+        # GID of each code.
+        self.gids = gdf[finest_label].to_numpy()
+
+        # Code of each GID.
+        self.codes = pd.Series(
+            np.arange(len(self.gids)),
+            index = self.gids,
+        )
+
+        # Codes of the finest-level areas inside each coarse area.
+        # Iterate from 1 to the level BEFORE the finest level.
+        self.descendants = {}
+        for level in range(1, finest_level):
+            coarse_label = f"GID_{level}"
+            self.descendants[level] = gdf.groupby(coarse_label, sort = False).indices
+
+        # All GIDs at every level, used to check whether a GID exists.
+        self.level_gids = {
+            level: set(gdf[f"GID_{level}"])
+            for level in range(1, finest_level + 1)
+        }
+
+    def __len__(self):
+        return len(self.gids)
+
+    def is_valid(self, level, gid):
+        """Whether gid is the GID of an area at the given level."""
+        result = (level in self.level_gids) and (gid in self.level_gids[level])
+        return result
+
+    def descendant_codes(self, level, gid):
+        """Codes of the finest-level areas inside an area. For a finest-level area, this is just its own code."""
+        if level == self.finest_level:
+            if gid in self.codes.index:
+                return np.array([self.codes[gid]])
+            return np.array([], dtype = np.int64)
+
+        result = self.descendants[level].get(gid, np.array([], dtype = np.int64))
+        return result
+
+    def encode(self, gids):
+        """Codes of many finest-level GIDs at once. Unknown GIDs get -1."""
+        result = (
+            self.codes
+            .reindex(gids)
+            .fillna(-1)
+            .astype(np.int64)
+            .to_numpy()
+        )
+        return result
+
+@st.cache_resource
+def get_gid_index(finest_level, _gdf):
+    """Build the GidIndex of the GADM table. This only runs once per process.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+    result = GidIndex(finest_level, _gdf)
+    return result
+
+@st.cache_resource
+def get_selector_options(finest_level, _gdf):
+    """Options of the location selector, precomputed for every parent area.
+Returns a dictionary mapping each level number to a dictionary from parent GID to (sorted list of child names, dictionary from child name to child GID).
+At level 1, the only parent GID is None.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+
+    selector_options = {}
+
+    for level in range(1, finest_level + 1):
+        name_label = f"NAME_{level}"
+        gid_label = f"GID_{level}"
+
+        if level == 1:
+            # Provinces have no parent.
+            level_groups = [(None, _gdf[[name_label, gid_label]])]
+        else:
+            level_groups = _gdf[[f"GID_{level - 1}", name_label, gid_label]].groupby(f"GID_{level - 1}", sort = False)
+
+        level_options = {}
+        for parent_gid, children in level_groups:
+            # If a parent has two children with the same name, the first one is used.
+            name_to_gid = {}
+            for name, gid in zip(children[name_label], children[gid_label]):
+                name_to_gid.setdefault(name, gid)
+
+            level_options[parent_gid] = (sorted(name_to_gid), name_to_gid)
+
+        selector_options[level] = level_options
+
+    return selector_options
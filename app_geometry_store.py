@@ -0,0 +1,72 @@
+# Simplified GADM geometries for the maps of the app.
+# Drawing thousands of full-resolution polygons makes the map slow, so each map uses the coarsest simplified copy that still looks right for the number of areas drawn.
+# The simplified copies are built by convert_gadm_data.py (see gadm_artifact.py) and only read here, once per process.
+
+import streamlit as st
+from shapely.geometry import mapping
+
+from gadm_artifact import read_geometry, read_simplified_geometry, simplify_coverage, simplify_tolerances
+
+# Simplification tolerances in degrees, paired with the largest number of areas for which each tolerance is used.
+# A tolerance of 0 means the original geometry. A limit of None means there is no limit.
+tolerance_limits = list(zip(
+    (0,) + simplify_tolerances,
+    (100, 1000, 10000, None),
+))
+
+@st.cache_resource
+def get_geometry_store(finest_level, _gdf):
+    """Read the simplified geometries of all finest-level areas. This only runs once per process.
+Returns a dictionary mapping each tolerance to a GeoSeries indexed by finest-level GID.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+
+    finest_label = f"GID_{finest_level}"
+
+    if "geometry" in _gdf.columns:
+        geometry = _gdf.set_index(finest_label).geometry
+        simplified = simplify_coverage(geometry, simplify_tolerances)
+    else:
+        # The app only loads GADM attributes at startup, so the geometries are read here, in the same row order.
+        geometry = read_geometry(finest_level, index = _gdf[finest_label])
+        simplified = read_simplified_geometry(finest_level, simplify_tolerances, index = _gdf[finest_label])
+
+    store = {0: geometry}
+    store.update(simplified)
+
+    return store
+
+def choose_tolerance(n_areas):
+    """Choose the simplification tolerance for a map of n_areas areas."""
+    for tolerance, limit in tolerance_limits:
+        if (limit is None) or (n_areas <= limit):
+            return tolerance
+
+@st.cache_resource
+def get_geojson_features(finest_level, tolerance, _gdf):
+    """Convert every finest-level area into a GeoJSON feature, once per process and tolerance.
+Returns a dictionary mapping each GID to its feature, whose id is the GID. The features are shared by every session, so they must not be changed."""
+    store = get_geometry_store(finest_level, _gdf)
+
+    features = {
+        gid: {
+            "type": "Feature",
+            "id": gid,
+            "properties": {},
+            "geometry": mapping(geom),
+        }
+        for gid, geom in store[tolerance].items()
+    }
+
+    return features
+
+def assemble_geojson(finest_level, gdf, gids):
+    """GeoJSON FeatureCollection of the given finest-level GIDs, simplified according to how many there are.
+It is put together from the cached features, so no geometry is converted again. Pass it to the geojson parameter of px.choropleth_mapbox()."""
+    tolerance = choose_tolerance(len(gids))
+    features = get_geojson_features(finest_level, tolerance, gdf)
+
+    result = {
+        "type": "FeatureCollection",
+        "features": [features[gid] for gid in gids],
+    }
+    return result
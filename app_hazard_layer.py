@@ -0,0 +1,205 @@
+# Hazard map layer data structure.
+# The layer keeps the entries the user added (provinces, cities, or barangays) and a bitmap of the finest-level areas they cover, using the integer codes of GidIndex.
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+
+from app_gadm_index import get_gid_index
+
+# Category of the areas at each level, as written in the layer table.
+level_categories = pd.Series(
+    {
+        1: "province",
+        2: "city or municipality",
+        3: "barangay",
+    }
+)
+
+class HazardLayer:
+    """Entries of a hazard map layer, plus the finest-level areas they cover.
+
+Entries are unique by GID and kept in the order they were added.
+coverage counts how many entries cover each finest-level area, so removing an entry only uncovers the areas that no other entry covers.
+The covered areas are available as a boolean array with one element per finest-level code (mask), which allows fast unions and intersections with other layers."""
+
+    columns = ["level", "category", "name", "gid"]
+
+    def __init__(self, gid_index):
+        self.gid_index = gid_index
+
+        # Dictionary mapping each GID to its (level, category, name).
+        self.entries = {}
+
+        self.coverage = np.zeros(len(gid_index), dtype = np.int32)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, gid):
+        return gid in self.entries
+
+    def add(self, level, category, name, gid):
+        """Add an entry. Returns False if an entry with the same GID is already in the layer."""
+        if gid in self.entries:
+            return False
+
+        level = int(level)
+        self.entries[gid] = (level, category, name)
+        self.coverage[self.gid_index.descendant_codes(level, gid)] += 1
+
+        return True
+
+    def add_frame(self, df):
+        """Add every row of a table in the layer CSV format. Rows whose GID is already in the layer are skipped.
+Returns the number of entries added."""
+        result = 0
+        for row in df.itertuples(index = False):
+            result += self.add(row.level, row.category, row.name, row.gid)
+        return result
+
+    def remove(self, gid):
+        """Remove the entry with the given GID."""
+        level, category, name = self.entries.pop(gid)
+        self.coverage[self.gid_index.descendant_codes(level, gid)] -= 1
+
+    def remove_at(self, position):
+        """Remove the entry at a row number of the layer table."""
+        gid = list(self.entries)[position]
+        self.remove(gid)
+
+    def clear(self):
+        """Remove all entries."""
+        self.entries = {}
+        self.coverage[:] = 0
+
+    @property
+    def mask(self):
+        """Boolean array of the finest-level areas covered by the layer, indexed by code."""
+        return self.coverage > 0
+
+    def key(self):
+        """Compact bytes identifying the covered areas. Used to cache results per layer."""
+        return np.packbits(self.mask).tobytes()
+
+    def union(self, other):
+        """Mask of the areas covered by this layer or the other layer."""
+        return self.mask | other.mask
+
+    def intersection(self, other):
+        """Mask of the areas covered by both this layer and the other layer."""
+        return self.mask & other.mask
+
+    def covered_gids(self):
+        """GIDs of the covered finest-level areas."""
+        return self.gid_index.gids[self.mask]
+
+    def to_frame(self):
+        """Table of entries with the level, category, name and gid columns of the layer CSV format."""
+        result = pd.DataFrame(
+            [
+                (level, category, name, gid)
+                for gid, (level, category, name) in self.entries.items()
+            ],
+            columns = self.columns,
+        )
+        return result
+
+def read_layer_csv(layer, file, chunksize = 10000, max_rejected = 1000):
+    """Append a layer CSV file to the layer, reading it in chunks of chunksize rows so that large files never have to fit in memory at once.
+Every row is checked: its level must be a level of the layer, and its gid must be the GID of an area at that level. Rows whose GID is already in the layer (including earlier rows of the same file) are skipped as duplicates.
+Raises ValueError if the file does not have the columns of the layer CSV format.
+Returns a tuple of (number of entries added, number of duplicates, DataFrame of rejected rows, number of rejected rows). At most max_rejected rows are kept in the DataFrame, together with their row number and the reason they were rejected."""
+
+    gid_index = layer.gid_index
+
+    n_added = 0
+    n_duplicates = 0
+    n_rejected = 0
+    rejected_lst = []
+
+    reader = pd.read_csv(
+        file,
+        chunksize = chunksize,
+        dtype = {"category": str, "name": str, "gid": str},
+    )
+
+    # Number of the first row of the current chunk, counting from 1.
+    row_start = 1
+
+    for chunk in reader:
+        if chunk.columns.tolist() != HazardLayer.columns:
+            raise ValueError("The format of this file is invalid.")
+
+        levels = pd.to_numeric(chunk["level"], errors = "coerce")
+
+        # Check every GID against the GIDs of its level.
+        valid_level = levels.isin(range(1, gid_index.finest_level + 1))
+        valid_gid = pd.Series(False, index = chunk.index)
+        for level, gids in gid_index.level_gids.items():
+            at_level = levels == level
+            valid_gid[at_level] = chunk.loc[at_level, "gid"].isin(gids)
+
+        valid = valid_level & valid_gid
+
+        for row in chunk.loc[valid].assign(level = levels[valid]).itertuples(index = False):
+            if layer.add(row.level, row.category, row.name, row.gid):
+                n_added += 1
+            else:
+                n_duplicates += 1
+
+        invalid_df = chunk.loc[~valid]
+        n_rejected += invalid_df.shape[0]
+
+        if (invalid_df.shape[0] > 0) and (len(rejected_lst) < max_rejected):
+            invalid_df = invalid_df.iloc[:max_rejected - len(rejected_lst)].copy()
+            invalid_df.insert(0, "row", invalid_df.index + row_start - chunk.index[0])
+            invalid_df["reason"] = np.where(valid_level[invalid_df.index], "unknown gid", "invalid level")
+            rejected_lst.extend(invalid_df.to_dict("records"))
+
+        row_start += chunk.shape[0]
+
+    rejected_df = pd.DataFrame(rejected_lst, columns = ["row"] + HazardLayer.columns + ["reason"])
+
+    result = (n_added, n_duplicates, rejected_df, n_rejected)
+    return result
+
+def area_entries(finest_level, gdf, codes):
+    """Layer table with one entry for each finest-level area in codes (row positions in the GADM table).
+Names are written like those of the location selector, from the finest level up to the province (e.g., "Barangay, City, Province")."""
+    name_labels = [f"NAME_{i}" for i in range(finest_level, 0, -1)]
+    areas = gdf.iloc[codes]
+
+    names = areas[name_labels[0]]
+    for label in name_labels[1:]:
+        names = names + ", " + areas[label]
+
+    result = pd.DataFrame(
+        {
+            "level": finest_level,
+            "category": level_categories[finest_level],
+            "name": names.to_numpy(),
+            "gid": areas[f"GID_{finest_level}"].to_numpy(),
+        },
+        columns = HazardLayer.columns,
+    )
+    return result
+
+def affected_matrix(gid_index, layers, gids):
+    """Boolean matrix with one row per finest-level GID in gids and one column per layer, True where the area is covered by the layer.
+The masks of all layers are stacked into one (areas x layers) array, so every GID is looked up once no matter how many layers there are. Unknown GIDs are not covered by any layer."""
+    stacked = np.column_stack([layer.mask for layer in layers])
+
+    codes = gid_index.encode(gids)
+    known = codes >= 0
+
+    result = np.zeros((len(codes), len(layers)), dtype = bool)
+    result[known] = stacked[codes[known]]
+    return result
+
+def get_session_layer(finest_level, gdf):
+    """The hazard map layer of the current session. It is created the first time it is needed."""
+    if "layer" not in st.session_state:
+        st.session_state.layer = HazardLayer(get_gid_index(finest_level, gdf))
+
+    return st.session_state.layer
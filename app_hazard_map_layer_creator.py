@@ -5,16 +5,18 @@ import pandas as pd
 import numpy as np
 
 from app_location_selector import location_selector
+from app_hazard_layer import get_session_layer, area_entries, read_layer_csv
+from app_export import convert_df_for_download
+from app_spatial import get_footprint_codes, get_radius_codes
 
 def hazard_map_feature(finest_level, gdf):
 
-    # Set up list of selected areas affected by a hazard
-    if "entries" not in st.session_state:
-        st.session_state.entries = pd.DataFrame()
+    # Set up the layer of selected areas affected by a hazard
+    layer = get_session_layer(finest_level, gdf)
 
     def entries_present():
         """Returns True if there are entries recorded."""
-        result = st.session_state.entries.shape[0] > 0
+        result = len(layer) > 0
         return result
 
     st.markdown("# Hazard Map Layer Creator")
@@ -28,20 +30,92 @@ def hazard_map_feature(finest_level, gdf):
     )
 
     if uploaded_file is not None:
-        up_df = pd.read_csv(uploaded_file)
-
-        correct_columns = up_df.columns.tolist() == ["level", "category", "name", "gid"]
+        # Only the header is read here. The rows are read in chunks when the layer is appended.
+        correct_columns = pd.read_csv(uploaded_file, nrows = 0).columns.tolist() == ["level", "category", "name", "gid"]
 
         if not correct_columns:
             st.warning("The format of this file is invalid.")
             st.stop()
 
         if st.button("Append this layer to the current layer"):
+            uploaded_file.seek(0)
+
+            # Entries whose GID is already in the layer are skipped.
+            # Entries whose GID does not exist at their level (e.g., from a different version of GADM) are rejected.
+            n_added, n_duplicates, rejected_df, n_rejected = read_layer_csv(layer, uploaded_file)
+
+            st.success(f"Added {n_added} entries. Skipped {n_duplicates} entries that were already in the layer.")
+
+            if n_rejected > 0:
+                st.warning(f"Rejected {n_rejected} entries whose level or GID is invalid.")
+
+                with st.expander("Rejected entries", expanded = False):
+                    if n_rejected > rejected_df.shape[0]:
+                        st.markdown(f"Only the first {rejected_df.shape[0]} are shown.")
+                    st.dataframe(rejected_df)
 
-            st.session_state.entries = pd.concat(
-                [st.session_state.entries, up_df],
-                axis = 0,
-            ).reset_index(drop = True)
+    # Hazard footprints, such as flood extents or volcano danger zones.
+    st.markdown("## Add Areas from a Hazard Footprint")
+    st.markdown("Upload the polygons of a hazard advisory. Every area that intersects them can be added to the layer. Shapefiles must be uploaded as a ZIP file containing all of their parts.")
+
+    footprint_file = st.file_uploader(
+        "Select a File (GeoJSON, GeoPackage, or zipped shapefile)",
+        type = ["geojson", "json", "gpkg", "zip"],
+    )
+
+    if footprint_file is not None:
+        min_overlap_perc = st.slider(
+            "Minimum overlap (%)",
+            min_value = 0,
+            max_value = 100,
+            value = 0,
+            help = "Only add areas with at least this percentage of their land inside the footprint. At 0%, any area that touches the footprint is added.",
+        )
+
+        try:
+            footprint_codes = get_footprint_codes(finest_level, gdf, footprint_file.getvalue(), min_overlap_perc / 100)
+        except Exception:
+            # The rest of the page is still shown, so the layer can be edited in other ways.
+            footprint_codes = None
+            st.warning("This file could not be read as a hazard footprint.")
+
+        if footprint_codes is not None:
+            st.markdown(f"The footprint covers {len(footprint_codes)} areas.")
+
+            if (len(footprint_codes) > 0) and st.button("Add these areas to the current layer"):
+
+                # Areas already in the layer are skipped.
+                layer.add_frame(area_entries(finest_level, gdf, footprint_codes))
+
+    # Hazards that cover everything within some distance of a point, such as a volcanic eruption or an industrial fire.
+    st.markdown("## Add Areas Around Points")
+    st.markdown("Enter the latitude and longitude of each point, and the radius of the hazard around it in kilometers. Every area within the radius of any point can be added to the layer.")
+
+    points_df = st.experimental_data_editor(
+        pd.DataFrame(
+            {
+                "latitude": pd.Series(dtype = float),
+                "longitude": pd.Series(dtype = float),
+                "radius_km": pd.Series(dtype = float),
+            }
+        ),
+        num_rows = "dynamic",
+        key = "radius points - hazard map layer creator",
+    )
+
+    # Rows that are still being filled in are ignored.
+    points_df = points_df.dropna().reset_index(drop = True)
+    points_df = points_df.loc[points_df["radius_km"] > 0]
+
+    if points_df.shape[0] > 0:
+        radius_codes = get_radius_codes(finest_level, gdf, points_df)
+
+        st.markdown(f"The circles around these points cover {len(radius_codes)} areas.")
+
+        if (len(radius_codes) > 0) and st.button("Add the areas around these points to the current layer"):
+
+            # Areas already in the layer are skipped.
+            layer.add_frame(area_entries(finest_level, gdf, radius_codes))
 
     st.markdown("---")
 
@@ -75,27 +149,18 @@ def hazard_map_feature(finest_level, gdf):
                 delete_index = st.number_input(
                     "Choose a row number",
                     min_value = 0,
-                    max_value = len(st.session_state.entries) - 1,
+                    max_value = len(layer) - 1,
                     value = 0,
                 )
                 
                 if st.button("Delete the entry at the chosen row"):
-                    st.session_state.entries = st.session_state.entries.drop(
-                        delete_index,
-                        axis = 0,
-                    ).reset_index(
-                        drop = True,
-                    )
+                    layer.remove_at(delete_index)
 
                 if st.button("Delete the most recently added entry"):
-                    st.session_state.entries.drop(
-                        index = st.session_state.entries.index[-1],
-                        axis = 0,
-                        inplace = True,
-                    )
+                    layer.remove_at(len(layer) - 1)
 
                 if st.button("Delete all entries"):
-                    st.session_state.entries = pd.DataFrame()
+                    layer.clear()
 
         # I used a new if-clause.
         # If a deletion action leaves the layer empty, this will immediately remove the deletion options and put a Warning instead.
@@ -107,7 +172,7 @@ def hazard_map_feature(finest_level, gdf):
     st.markdown("---\n\n## View Areas")
 
     if entries_present():
-        display_entries_df = st.session_state.entries.loc[:, ["name", "category"]]
+        display_entries_df = layer.to_frame().loc[:, ["name", "category"]]
         st.dataframe(display_entries_df)
     else:
         st.warning("No entries yet.")
@@ -121,13 +186,8 @@ def hazard_map_feature(finest_level, gdf):
             value = "new_layer",
         )
 
-        @st.cache_data(ttl = None)
-        def convert_df_for_download(df):
-            """Convert a dataframe so that it can be downloaded using st.download_button()"""
-            result = df.to_csv(index = False).encode("utf-8")
-            return result
-
-        csv = convert_df_for_download(st.session_state.entries)
+        # Layers are always saved as CSV so that they can be uploaded again.
+        csv = convert_df_for_download(layer.to_frame(), "CSV")
 
         st.download_button(
             "Download hazard map layer as CSV",
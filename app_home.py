@@ -5,7 +5,7 @@ import streamlit as st
 def home_feature():
     st.markdown("""# Home Page
 
-Welcome to the ASHS Student-Hazard App. Start by visiting the Hazard Map Layer Creator. When you are done making a layer, go to the Report Generator. You may go back to change the layer if needed. Also remember to save your layer and the report outputs. If you close or refresh this tab, your progress will be lost.""")
+Welcome to the ASHS Student-Hazard App. Start by visiting the Hazard Map Layer Creator. When you are done making a layer, go to the Report Generator. To report on several hazards at once, save each layer and upload them all in the Batch Report. You may go back to change the layer if needed. Also remember to save your layer and the report outputs. If you close or refresh this tab, your progress will be lost.""")
 
     with st.expander("Credits", expanded = False):
         st.markdown("""The Student Mapping Project is a collaboration between the Programming Varsity, the Kanlaon committee, and the school administration. The app itself was developed by Miguel Antonio H. Germar, ASHS Batch '22.
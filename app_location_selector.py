@@ -1,52 +1,40 @@
 # Location selector feature
 
 import streamlit as st
-import pandas as pd
 import numpy as np
 
+from app_gadm_index import get_selector_options
+from app_hazard_layer import get_session_layer, level_categories
+
 def location_selector(finest_level, gdf, key):
     """Location selector interface. Allows the user to select areas and add them to the hazard map layer."""
 
-    # List of columns to take from GDF.
-    # Should include only GID and NAME columns down to the finest level.
-    gdf_cols = [
-        s.format(level)
-        for level in range(1, finest_level + 1)
-        for s in ["GID_{}", "NAME_{}"]
-    ]
-
-    gdf_subset = gdf[gdf_cols].copy()
-
-    level_categories = pd.Series(
-        {
-            1: "province",
-            2: "city or municipality",
-            3: "barangay",
-        }
-    )
-
-    level_categories = level_categories.loc[:finest_level]
+    # Sorted options for every parent area, precomputed once and shared by all sessions.
+    selector_options = get_selector_options(finest_level, gdf)
 
     gid_list = []
 
     # Note that "name" here refers to location name.
     name_list = []
 
+    # GID of the area selected at the previous level. Provinces have no parent.
+    parent_gid = None
+
     for level in range(1, finest_level + 1):
-        name_label = f"NAME_{level}"
-        gid_label = f"GID_{level}"
         cat = level_categories[level]
 
+        # Names and GIDs of the areas inside the selected parent area.
+        child_names, name_to_gid = selector_options[level][parent_gid]
+
         cur_name = st.selectbox(
             cat.title(),
-            options = gdf_subset[name_label].unique(),
+            options = child_names,
             # Use a key so that multiple instances of location selectors are not connected.
             key = key + " " + "/".join(gid_list),
         )
 
-        gdf_subset = gdf_subset.loc[gdf_subset[name_label] == cur_name]
-
-        gid = (gdf_subset.loc[:, gid_label].iloc[0])
+        gid = name_to_gid[cur_name]
+        parent_gid = gid
 
         gid_list.append(gid)
         name_list.append(cur_name)
@@ -55,17 +43,11 @@ def location_selector(finest_level, gdf, key):
 
             full_location_name = ", ".join(reversed(name_list))
 
-            new_row = pd.Series(
-                {
-                    "level": level,
-                    "category": cat,
-                    "name": full_location_name,
-                    "gid": gid,
-                },
-                # Set the name of the Series to the next index above the highest index in the DF of entries.
-                name = st.session_state.entries.shape[0]
+            get_session_layer(finest_level, gdf).add(
+                level = level,
+                category = cat,
+                name = full_location_name,
+                gid = gid,
             )
 
-            st.session_state.entries = st.session_state.entries.append(new_row)
-
     return
\ No newline at end of file
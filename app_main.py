@@ -3,17 +3,18 @@ Migs Germar, 2021
 Main script for the Student Mapping Project app.
 """
 
-import pandas as pd
-import geopandas as gpd
 import streamlit as st
 import bcrypt as bc
-import copy
 
 # Custom imports for app features
 from app_home import home_feature
 from app_hazard_map_layer_creator import hazard_map_feature
 from app_report_generator import report_generator_feature
+from app_batch_report import batch_report_feature
 from app_student_areas import student_areas_feature
+from app_shared_data import read_only_view
+from app_student_source import GoogleSheetsSource, CSVSource, SQLiteSource, StudentStore
+from gadm_artifact import read_attributes
 
 # For connecting to private Google Sheets file
 from google.oauth2 import service_account
@@ -38,10 +39,6 @@ if __name__ == "__main__":
     if "pw_passed" not in st.session_state:
         st.session_state["pw_passed"] = False
 
-    # Refresh counter system
-    if "refresh_counter" not in st.session_state:
-        st.session_state["refresh_counter"] = 0
-
     if not st.session_state["pw_passed"]:
 
         pw_empty = st.empty()
@@ -76,49 +73,74 @@ if __name__ == "__main__":
             # If password is incorrect, do not continue the script.
             st.stop()
 
-    # Create a connection object.
-    credentials = service_account.Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"],
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-        ],
-    )
-    conn = connect(credentials = credentials)
-    sheet_url = st.secrets["private_gsheets_url"]
-
-    @st.cache_data(ttl = None)
-    def get_data(refresh_counter):
-        """Obtain needed data."""
-        # GADM data
-        gpkg = "./geo_data/gadm36_PHL.gpkg"
-        gdf = gpd.read_file(gpkg, layer = f"gadm36_PHL_{finest_level}")
-
-        # Query the Google Sheets file.
-        query = f'SELECT * FROM "{sheet_url}"'
-
-        rows = conn.execute(
-            query,
-            headers = 1,
-        )
+    @st.cache_resource
+    def get_gadm_data(finest_level):
+        """Obtain the GADM data. It never changes, so it is loaded once per process and shared by all sessions.
+        Features get a shallow copy of it, and copy-on-write (turned on by app_shared_data) keeps their changes from reaching the shared data."""
+        # Only the attribute columns (GIDs and names) are loaded here.
+        # The geometries are loaded separately by the geometry store the first time a map is drawn.
+        gdf = read_attributes(finest_level)
+
+        return gdf
+
+    @st.cache_resource
+    def get_student_store():
+        """Set up the student data store. It is created once per process and shared by all sessions.
+        The student_source secret chooses where student data comes from: "gsheets" (default), "csv" or "sqlite".
+        A local CSV or SQLite file can stand in for the Google Sheets file during offline testing."""
+
+        source_type = st.secrets.get("student_source", "gsheets")
 
-        # Student location data
-        students_df = pd.DataFrame(rows)
+        if source_type == "csv":
+            source = CSVSource(st.secrets["student_source_path"])
 
-        int_cols = ["student_number", "grade_level"]
-        for col in int_cols:
-            students_df[col] = students_df[col].astype(int)
+        elif source_type == "sqlite":
+            source = SQLiteSource(
+                st.secrets["student_source_path"],
+                st.secrets.get("student_source_table", "students"),
+            )
 
-        return gdf, students_df
+        else:
+            # Create a connection object.
+            credentials = service_account.Credentials.from_service_account_info(
+                st.secrets["gcp_service_account"],
+                scopes = [
+                    "https://www.googleapis.com/auth/spreadsheets",
+                ],
+            )
+            conn = connect(credentials = credentials)
+            sheet_url = st.secrets["private_gsheets_url"]
+
+            source = GoogleSheetsSource(conn, sheet_url)
+
+        store = StudentStore(
+            source,
+            # Column whose value increases whenever a row changes. If set, refreshes only fetch changed rows.
+            version_col = st.secrets.get("student_version_column", None),
+            # Column marking removed students, used together with the version column.
+            deleted_col = st.secrets.get("student_deleted_column", None),
+            # Number of seconds before the student data is fetched again even without pressing Refresh. None means never.
+            ttl = st.secrets.get("student_data_ttl", None),
+        )
+
+        return store
 
-    # Increment the refresh counter when the Refresh button is pressed.
-    # This way, every time it's pressed, the app will be forced to read the data from the gsheets file again.
-    # The re-read will only occur directly after a press of the Refresh button.
+    student_store = get_student_store()
+
+    # When the Refresh button is pressed, the student data is synced with its source.
+    # Only the student data is fetched again, not the GADM data.
     with st.sidebar:
         if st.button("Refresh data"):
-            st.session_state["refresh_counter"] += 1
+            student_store.sync()
 
     # Obtain data.
-    gdf, students_df = copy.deepcopy(get_data(st.session_state["refresh_counter"]))
+    # Features get a read-only view of the shared GADM data instead of a deep copy.
+    gdf = read_only_view(get_gadm_data(finest_level))
+
+    # The student data is shared too, so features also get a read-only view of it.
+    # data_version is read together with the data, so caches keyed by it always match the data they were built from.
+    students_df, data_version = student_store.get()
+    students_df = read_only_view(students_df)
 
     with st.sidebar:
         
@@ -130,6 +152,7 @@ if __name__ == "__main__":
                 "Student-populated Areas",
                 "Hazard Map Layer Creator",
                 "Report Generator",
+                "Batch Report",
             ]
         )
 
@@ -143,4 +166,7 @@ if __name__ == "__main__":
         hazard_map_feature(finest_level, gdf)
     
     elif feature == "Report Generator":
-        report_generator_feature(finest_level, gdf, students_df)
+        report_generator_feature(finest_level, gdf, students_df, data_version)
+
+    elif feature == "Batch Report":
+        batch_report_feature(finest_level, gdf, students_df, data_version)
@@ -2,25 +2,28 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
 import plotly.express as px
+import streamlit.components.v1 as components
 
-def report_generator_feature(finest_level, gdf, students_df):
-    """Generates a report about the students who live in the hazard-affected areas."""
+from app_geometry_store import assemble_geojson
+from app_gadm_index import get_gid_index
+from app_student_cube import get_student_cube
+from app_export import download_table
+from app_static_map import render_static_map, default_static_map_threshold
+
+def report_generator_feature(finest_level, gdf, students_df, data_version):
+    """Generates a report about the students who live in the hazard-affected areas.
+    data_version identifies the current student data, so that the student counts are only recomputed when the data changes."""
 
     st.markdown("# Report Generator")
     st.markdown("Ensure that the hazard map layer is complete before saving these results.")
 
-    if ("entries" not in st.session_state) or (st.session_state.entries.shape[0] == 0):
+    if ("layer" not in st.session_state) or (len(st.session_state.layer) == 0):
         st.warning("There are no entries yet in the hazard map layer.")
         st.stop()
 
-    # Hazard map layer. Drop duplicates.
-    hazmap = (
-        st.session_state.entries
-        .copy()
-        .drop_duplicates(subset = "gid", keep = "first")
-    )
+    # Hazard map layer. Its entries are already unique by GID.
+    layer = st.session_state.layer
 
     name_labels = [f"NAME_{i}" for i in range(1, finest_level + 1)]
 
@@ -29,76 +32,18 @@ def report_generator_feature(finest_level, gdf, students_df):
 
     finest_name_label = f"NAME_{finest_level}"
 
-    @st.cache_data(ttl = None)
-    def identify_affected(finest_level, finest_label, _gdf, students_df, hazmap, name_labels):
-        """Based on the hazard map layer, obtain a DF of all students in the affected areas.
-        The _gdf parameter has a leading underscore so that it is not hashed by st.cache_data()."""
+    # Integer codes of the finest-level areas.
+    gid_index = get_gid_index(finest_level, gdf)
 
-        # Set of fine-grained GIDs.
-        gid_set = set(
-            hazmap.loc[
-                hazmap.level == finest_level,
-                "gid",
-            ]
-            .to_list()
-        )
-
-        # Iterate through all coarse levels.
-        # Iterate from 1 to the level BEFORE the finest level.
-        for level_num in range(1, finest_level):
-            subset = hazmap.loc[hazmap.level == level_num].copy()
-            coarse_label = f"GID_{level_num}"
-
-            # For each "coarse" area (e.g., province), obtain its "fine" GIDs (e.g., the GIDs of its barangays).
-            # Then, update gid_set with the fine GIDs.
-            for index, row in subset.iterrows():
-                coarse_gid = row["gid"]
-                fine_gid_series = _gdf.loc[
-                    _gdf[coarse_label] == coarse_gid,
-                    finest_label
-                ]
-                gid_set.update(fine_gid_series)
-
-        student_info_cols = [
-            "strand",
-            "grade_level",
-            "section",
-            "student_number",
-        ]
-
-        affected_df = (
-            students_df
-            .loc[
-                :, 
-                student_info_cols + [finest_label]
-            ]
-            # Sort rows
-            .sort_values(by = student_info_cols)
-            .reset_index(drop = True)
-            # Include location names
-            .merge(
-                _gdf[name_labels + [finest_label]],
-                how = "left",
-                left_on = finest_label,
-                right_on = finest_label
-            )
-        )
-
-        # Mask of students affected by hazard
-        affected_df["affected_bool"] = affected_df[finest_label].isin(gid_set)
-
-        # Column of Yes or No strings
-        affected_df["affected"] = affected_df["affected_bool"].replace({True: "Yes", False: "No"})
-
-        return affected_df, gid_set
-
-    affected_df, gid_set = identify_affected(finest_level, finest_label, gdf, students_df, hazmap, name_labels)
+    # Student counts per area and class, shared by all sessions until the student data changes.
+    cube = get_student_cube(finest_level, data_version, gdf, students_df)
 
     st.markdown("## Main Statistics")
 
-    num_affected = affected_df["affected_bool"].sum()
+    # The statistics only add up the student counts of the affected areas.
+    num_affected = cube.count(layer.mask)
     perc_affected = round(
-        num_affected / affected_df.shape[0] * 100,
+        num_affected / cube.n_students * 100,
         2
     )
 
@@ -118,36 +63,31 @@ def report_generator_feature(finest_level, gdf, students_df):
         st.warning("No students are affected by this hazard, so a report has not been generated.")
         st.stop()
 
+    with st.expander("Affected students per strand, grade level and section", expanded = False):
+        class_df = (
+            cube.class_counts(layer.mask)
+            .rename("Number of Affected ASHS Students")
+            .reset_index()
+            .rename(columns = {"strand": "Strand", "grade_level": "Grade Level", "section": "Section"})
+        )
+        st.dataframe(class_df)
+
     # Map feature
     st.markdown("## Map of the Philippines")
-    st.markdown("Colored areas indicate areas affected by the hazard. Uncolored areas indicate areas not affected. The hue of each area indicates how many ASHS students are affected; refer to the legend. Not all affected areas have ASHS students.\n\nHover over a city to see its name and the exact number of students affected. Pan by dragging with the left mouse button. Zoom in and out with the scroll wheel. To save a photo, adjust the pan and zoom to the desired area. Then, hover over the top right of the image and click the camera button (Download plot as a png).")
+    st.markdown("Colored areas indicate areas affected by the hazard. Uncolored areas indicate areas not affected. The hue of each area indicates how many ASHS students are affected; refer to the legend. Not all affected areas have ASHS students.")
     
-    affected_per_city = (
-        affected_df
-        .loc[affected_df["affected_bool"]]
-        .pivot_table(
-            index = finest_label,
-            values = "affected_bool",
-            aggfunc = np.sum,
-        )
-        .rename(columns = {"affected_bool": "number_affected"})
-    )
-
     map_df = (
         gdf
         .loc[
-            gdf[finest_label].isin(gid_set),
-            name_labels + ["geometry", finest_label]
+            # Rows of the GADM table are in code order, so the layer's bitmap selects the affected areas.
+            layer.mask,
+            name_labels + [finest_label]
         ]
-        .merge(
-            affected_per_city,
-            how = "left",
-            left_on = finest_label,
-            right_index = True,
-        )
+        .copy()
     )
 
-    map_df["number_affected"] = map_df["number_affected"].fillna(0)
+    # Number of students in each affected area, in the same code order.
+    map_df["number_affected"] = cube.area_counts(layer.mask)
 
     # Series of name labels and their corresponding categories
     name_categories = pd.Series(
@@ -177,25 +117,104 @@ def report_generator_feature(finest_level, gdf, students_df):
     coarse_categories = name_categories.iloc[0:(finest_level - 1)].to_list()
     hover_data = coarse_categories + ["Number of Affected ASHS Students"]
 
-    # Make map
+    # Large layers are shown as a static image by default, because an interactive map of that many areas is slow on low-end laptops.
+    static_map_threshold = st.secrets.get("static_map_threshold", default_static_map_threshold)
 
-    fig = px.choropleth_mapbox(
-        map_df,
-        geojson = map_df.geometry,
-        locations = map_df.index,
-        color = "Number of Affected ASHS Students",
-        color_continuous_scale = "Viridis",
-        range_color = None,
-        mapbox_style = "carto-positron",
-        zoom = 4.2,
-        center = {"lat": 12.879721, "lon": 121.774017},
-        opacity = 0.5,
-        hover_name = hover_name,
-        hover_data = hover_data,
+    map_type = st.radio(
+        "Map type",
+        options = ["Interactive map", "Static image"],
+        index = 1 if map_df.shape[0] > static_map_threshold else 0,
+        horizontal = True,
+        help = f"Layers with more than {static_map_threshold} areas are shown as a static image by default.",
     )
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    
-    st.plotly_chart(fig)
+
+    # Make map
+
+    @st.cache_resource(max_entries = 20)
+    def make_affected_map(finest_level, _gdf, map_df, hover_name, hover_data):
+        """Make the map of affected areas as HTML, with the figure already encoded as JSON. It is cached by the areas, names and counts in map_df, so reruns with the same layer reuse it.
+        Only the HTML text is cached and shared, not the figure, so reruns neither encode the figure again nor share a mutable object between sessions.
+        The _gdf parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+
+        # The GeoJSON is assembled from cached, simplified features.
+        geojson = assemble_geojson(finest_level, _gdf, map_df.index)
+
+        fig = px.choropleth_mapbox(
+            map_df,
+            geojson = geojson,
+            locations = map_df.index,
+            color = "Number of Affected ASHS Students",
+            color_continuous_scale = "Viridis",
+            range_color = None,
+            mapbox_style = "carto-positron",
+            zoom = 4.2,
+            center = {"lat": 12.879721, "lon": 121.774017},
+            opacity = 0.5,
+            hover_name = hover_name,
+            hover_data = hover_data,
+        )
+        fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+        # plotly.js is loaded from its CDN, like the map tiles.
+        html = fig.to_html(include_plotlyjs = "cdn", full_html = False)
+
+        return html
+
+    if map_type == "Static image":
+        png = render_static_map(finest_level, gdf, map_df["Number of Affected ASHS Students"])
+
+        st.image(png)
+
+        st.download_button(
+            "Download map as PNG",
+            data = png,
+            file_name = "hazard_map.png",
+            mime = "image/png",
+        )
+
+    else:
+        st.markdown("Hover over an area to see its name and the exact number of students affected. Pan by dragging with the left mouse button. Zoom in and out with the scroll wheel. To save a photo, adjust the pan and zoom to the desired area. Then, hover over the top right of the image and click the camera button (Download plot as a png).")
+
+        html = make_affected_map(finest_level, gdf, map_df, hover_name, hover_data)
+
+        components.html(html, height = 500)
+
+    @st.cache_data(ttl = None)
+    def identify_affected(finest_label, data_version, layer_key, _students_df, _layer, _gid_index):
+        """Based on the hazard map layer, obtain a DF of all students in the affected areas.
+        This is only needed for the table of students. The statistics and the map use the student counts instead.
+        layer_key identifies the areas covered by the layer, so the result is cached per version of the student data and per layer without hashing the roster itself.
+        The _students_df, _layer and _gid_index parameters have a leading underscore so that they are not hashed by st.cache_data()."""
+
+        student_info_cols = [
+            "strand",
+            "grade_level",
+            "section",
+            "student_number",
+        ]
+
+        affected_df = (
+            _students_df
+            .loc[
+                :, 
+                student_info_cols + [finest_label]
+            ]
+            # Sort rows
+            .sort_values(by = student_info_cols)
+            .reset_index(drop = True)
+        )
+
+        # Mask of students affected by hazard.
+        # Each student's area code is looked up in the layer's bitmap. Students with unknown GIDs (code -1) are not affected.
+        student_codes = _gid_index.encode(affected_df[finest_label])
+        affected_df["affected_bool"] = (student_codes >= 0) & _layer.mask[student_codes]
+
+        # Column of Yes or No strings
+        affected_df["affected"] = affected_df["affected_bool"].replace({True: "Yes", False: "No"})
+
+        return affected_df
+
+    affected_df = identify_affected(finest_label, data_version, layer.key(), students_df, layer, gid_index)
 
     st.markdown("## Table of Affected Students")
 
@@ -219,7 +238,7 @@ def report_generator_feature(finest_level, gdf, students_df):
 
     # Let the user save the table.
     st.markdown("## Save Table")
-    st.markdown("Note that the table shown above includes only affected students. On the other hand, the table that is downloaded will include all ASHS students. A column will indicate whether each student is affected by the hazard or not.\n\nAlso, the CSV file is a text file that can be opened in Excel as a spreadsheet. Use 'Save As' to change its file type.")
+    st.markdown("Note that the table shown above includes only affected students. On the other hand, the table that is downloaded will include all ASHS students. A column will indicate whether each student is affected by the hazard or not.\n\nThe CSV file is a text file that can be opened in Excel as a spreadsheet. For large reports, the compressed CSV and Parquet files are much smaller. The Excel file has one sheet per strand and grade level.")
 
     filename = st.text_input(
         "Filename (without extension)",
@@ -232,17 +251,9 @@ def report_generator_feature(finest_level, gdf, students_df):
         .copy()
     )
 
-    @st.cache_data(ttl = None)
-    def convert_df_for_download(df):
-        """Convert a dataframe so that it can be downloaded using st.download_button()"""
-        result = df.to_csv(index = False).encode("utf-8")
-        return result
-
-    csv = convert_df_for_download(save_df)
-
-    st.download_button(
-        "Download complete table as CSV",
-        data = csv,
-        file_name = f"{filename}.csv",
-        mime = "text/csv",
+    download_table(
+        save_df,
+        filename,
+        "Download complete table",
+        key = "export format - report generator",
     )
\ No newline at end of file
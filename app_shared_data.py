@@ -0,0 +1,19 @@
+# Read-only sharing of cached DataFrames.
+# Data cached with st.cache_resource is one object shared by every session and rerun, so each rerun gets a cheap shallow copy of it instead of a deep copy.
+# Copy-on-write is turned on when this module is imported. With it, changing values in a shallow copy (e.g., with .loc) first copies the changed column, so the shared data is never changed for other sessions.
+# pandas 1.5 supports copy-on-write as an option. From pandas 3.0, it is always on.
+
+import pandas as pd
+
+def enable_copy_on_write():
+    """Turn on pandas copy-on-write, unless it is already always on."""
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+enable_copy_on_write()
+
+def read_only_view(df):
+    """Shallow copy of shared data for one rerun.
+It shares the data, so nothing is duplicated. With copy-on-write, any change to the copy (adding, dropping or renaming columns, or changing values) only affects the copy."""
+    result = df.copy(deep = False)
+    return result
@@ -0,0 +1,46 @@
+# Spatial lookups of the app, such as finding the areas covered by a hazard footprint.
+# They use the full-resolution geometries of the geometry store. Its spatial index is built the first time it is queried and then reused by every session.
+
+import io
+
+import streamlit as st
+import geopandas as gpd
+
+from app_geometry_store import get_geometry_store
+from gadm_spatial import footprint_to_areas, buffer_points
+
+def get_area_geometry(finest_level, _gdf):
+    """Full-resolution geometries of the finest-level areas, in the same row order as the GADM table.
+They come from the cached geometry store, so they are only loaded once per process."""
+    result = get_geometry_store(finest_level, _gdf)[0]
+    return result
+
+@st.cache_data(ttl = None, max_entries = 20)
+def get_footprint_codes(finest_level, _gdf, file_bytes, min_overlap):
+    """Codes of the finest-level areas covered by an uploaded hazard footprint file (GeoJSON, GeoPackage, or zipped shapefile).
+The result is cached per file and minimum overlap, so changing other widgets does not repeat the search.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_data()."""
+    footprint = gpd.read_file(io.BytesIO(file_bytes)).geometry
+
+    result = footprint_to_areas(
+        get_area_geometry(finest_level, _gdf),
+        footprint,
+        min_overlap = min_overlap,
+    )
+    return result
+
+@st.cache_data(ttl = None, max_entries = 50)
+def get_radius_codes(finest_level, _gdf, points_df):
+    """Codes of the finest-level areas within a radius of one or more points.
+points_df has the latitude, longitude and radius_km columns. The result is cached per table of points, so trying a radius again is instant.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_data()."""
+    points = gpd.GeoSeries(
+        gpd.points_from_xy(points_df["longitude"], points_df["latitude"]),
+        crs = "EPSG:4326",
+    )
+
+    result = footprint_to_areas(
+        get_area_geometry(finest_level, _gdf),
+        buffer_points(points, points_df["radius_km"]),
+    )
+    return result
@@ -0,0 +1,61 @@
+# Static image version of the map of affected areas, drawn on the server.
+# For very large hazard layers, one image is much lighter for the browser than tens of thousands of interactive polygons, and it needs no map tiles from the internet.
+
+import io
+
+import streamlit as st
+import geopandas as gpd
+
+from app_geometry_store import get_geometry_store, choose_tolerance, tolerance_limits
+
+# Layers with more areas than this are shown as a static image by default.
+# This can be changed with the static_map_threshold secret.
+default_static_map_threshold = 5000
+
+@st.cache_data(ttl = None, max_entries = 20)
+def render_static_map(finest_level, _gdf, number_affected):
+    """Draw the affected areas, colored by the number of affected students, as PNG bytes.
+number_affected is a Series indexed by finest-level GID. The image is cached per layer.
+The _gdf parameter has a leading underscore so that it is not hashed by st.cache_data()."""
+
+    # Import matplotlib here so that it is only loaded when a static map is needed.
+    # The object-oriented Figure is used instead of pyplot because pyplot is not thread-safe.
+    from matplotlib.figure import Figure
+
+    store = get_geometry_store(finest_level, _gdf)
+
+    # The whole country, at the coarsest tolerance, is drawn in gray as the background.
+    coarsest_tolerance = tolerance_limits[-1][0]
+    background = store[coarsest_tolerance]
+
+    geometry = store[choose_tolerance(len(number_affected))].loc[number_affected.index]
+    affected_gdf = gpd.GeoDataFrame(
+        {"number_affected": number_affected.to_numpy()},
+        geometry = geometry.to_numpy(),
+        crs = geometry.crs,
+    )
+
+    fig = Figure(figsize = (8, 10), dpi = 150)
+    ax = fig.subplots()
+
+    background.plot(ax = ax, color = "#e6e6e6", linewidth = 0)
+
+    affected_gdf.plot(
+        column = "number_affected",
+        cmap = "viridis",
+        ax = ax,
+        linewidth = 0,
+        legend = True,
+        legend_kwds = {
+            "label": "Number of Affected ASHS Students",
+            "shrink": 0.6,
+        },
+    )
+
+    ax.set_axis_off()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = "png", bbox_inches = "tight")
+
+    result = buffer.getvalue()
+    return result
@@ -4,6 +4,10 @@ import pandas as pd
 import geopandas as gpd
 import streamlit as st
 import plotly.express as px
+import streamlit.components.v1 as components
+
+from app_geometry_store import assemble_geojson
+from app_export import download_table
 
 def student_areas_feature(finest_level, gdf, students_df):
     st.markdown("# Student-populated Areas")
@@ -33,8 +37,8 @@ def student_areas_feature(finest_level, gdf, students_df):
         .to_list()
     )
 
-    # List of columns to keep in gdf_populated. geometry column contains geospatial data.
-    keep_cols = name_cols + [finest_gid_label, "geometry"]
+    # List of columns to keep in gdf_populated. The map's geometries are taken from the geometry store.
+    keep_cols = name_cols + [finest_gid_label]
 
     # GADM entries of populated areas
     gdf_populated = (
@@ -58,19 +62,11 @@ def student_areas_feature(finest_level, gdf, students_df):
     st.dataframe(display_df)
 
     # Let the user download the table
-    @st.cache_data(ttl = None)
-    def convert_df_for_download(df):
-        """Convert a dataframe so that it can be downloaded using st.download_button()"""
-        result = df.to_csv(index = False).encode("utf-8")
-        return result
-
-    csv = convert_df_for_download(display_df)
-
-    st.download_button(
-        "Download table as CSV",
-        data = csv,
-        file_name = f"student_populated_areas.csv",
-        mime = "text/csv",
+    download_table(
+        display_df,
+        "student_populated_areas",
+        "Download table",
+        key = "export format - student-populated areas",
     )
 
     # Display map
@@ -81,20 +77,36 @@ def student_areas_feature(finest_level, gdf, students_df):
     hover_name = name_categories.loc[finest_name_label]
 
     # Specify the list of variables to be shown in the hover tooltip. This includes the variables from the coarsest level down to one level above the finest level.
-    hover_data = name_categories.iloc[0:(finest_level - 1)]
-
-    fig = px.choropleth_mapbox(
-        gdf_populated,
-        geojson = gdf_populated.geometry,
-        locations = gdf_populated.index,
-        range_color = None,
-        mapbox_style = "carto-positron",
-        zoom = 4.2,
-        center = {"lat": 12.879721, "lon": 121.774017},
-        opacity = 0.5,
-        hover_name = hover_name,
-        hover_data = hover_data,
-    )
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    
-    st.plotly_chart(fig)
\ No newline at end of file
+    hover_data = name_categories.iloc[0:(finest_level - 1)].to_list()
+
+    @st.cache_resource(max_entries = 5)
+    def make_populated_map(finest_level, _gdf, gdf_populated, hover_name, hover_data):
+        """Make the map of populated areas as HTML, with the figure already encoded as JSON. It is cached by the areas in gdf_populated, so reruns reuse it until the student data changes.
+        Only the HTML text is cached and shared, not the figure, so reruns neither encode the figure again nor share a mutable object between sessions.
+        The _gdf parameter has a leading underscore so that it is not hashed by st.cache_resource()."""
+
+        # The GeoJSON is assembled from cached, simplified features.
+        geojson = assemble_geojson(finest_level, _gdf, gdf_populated.index)
+
+        fig = px.choropleth_mapbox(
+            gdf_populated,
+            geojson = geojson,
+            locations = gdf_populated.index,
+            range_color = None,
+            mapbox_style = "carto-positron",
+            zoom = 4.2,
+            center = {"lat": 12.879721, "lon": 121.774017},
+            opacity = 0.5,
+            hover_name = hover_name,
+            hover_data = hover_data,
+        )
+        fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+
+        # plotly.js is loaded from its CDN, like the map tiles.
+        html = fig.to_html(include_plotlyjs = "cdn", full_html = False)
+
+        return html
+
+    html = make_populated_map(finest_level, gdf, gdf_populated, hover_name, hover_data)
+
+    components.html(html, height = 500)
\ No newline at end of file
@@ -0,0 +1,79 @@
+# Precomputed counts of students per area and class.
+# The counts are built once per version of the student data, so reports only add up the counts of the affected areas instead of going through every student.
+
+import streamlit as st
+import numpy as np
+
+from app_gadm_index import get_gid_index
+
+class StudentCube:
+    """Number of students in each finest-level area, strand, grade level and section.
+
+cells holds one row per combination that has students, sorted by area code, with the columns code, strand, grade_level, section and count. The cells of an area are found through cell_starts, so selecting the cells of some areas only looks at those areas.
+area_totals holds the number of students in each area, indexed by code.
+Students with a missing strand, grade level or section are still counted, in cells where that column is missing. Students whose GID is not in the GADM table are only counted in n_students."""
+
+    class_cols = ["strand", "grade_level", "section"]
+
+    def __init__(self, gid_index, students_df):
+        self.gid_index = gid_index
+        finest_level = gid_index.finest_level
+
+        self.n_students = students_df.shape[0]
+
+        codes = gid_index.encode(students_df[f"GID_{finest_level}"])
+        known = codes >= 0
+
+        self.cells = (
+            students_df
+            .loc[known, self.class_cols]
+            .assign(code = codes[known])
+            .groupby(["code"] + self.class_cols, sort = True, dropna = False)
+            .size()
+            .rename("count")
+            .reset_index()
+        )
+
+        cell_codes = self.cells["code"].to_numpy()
+
+        # The cells of code i are the rows from cell_starts[i] to cell_starts[i + 1].
+        self.cell_starts = np.searchsorted(cell_codes, np.arange(len(gid_index) + 1))
+
+        # Counted from the students themselves, so that every student with a known GID is included.
+        self.area_totals = np.bincount(codes[known], minlength = len(gid_index))
+
+    def count(self, mask):
+        """Number of students in the areas where mask (a boolean array indexed by code, like a layer's mask) is True."""
+        result = int(self.area_totals[mask].sum())
+        return result
+
+    def area_counts(self, mask):
+        """Number of students in each area where mask is True, in code order."""
+        result = self.area_totals[mask]
+        return result
+
+    def class_counts(self, mask):
+        """Number of students per strand, grade level and section in the areas where mask is True."""
+        codes = np.flatnonzero(mask)
+
+        starts = self.cell_starts[codes]
+        lengths = self.cell_starts[codes + 1] - starts
+
+        # Row positions of the cells of every selected area.
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        result = (
+            self.cells
+            .iloc[positions]
+            .groupby(self.class_cols, sort = True, dropna = False)
+            ["count"]
+            .sum()
+        )
+        return result
+
+@st.cache_resource(max_entries = 2)
+def get_student_cube(finest_level, data_version, _gdf, _students_df):
+    """Build the StudentCube of the student data. It is rebuilt only when data_version changes, i.e., when a sync changes the student data.
+The _gdf and _students_df parameters have a leading underscore so that they are not hashed by st.cache_resource()."""
+    result = StudentCube(get_gid_index(finest_level, _gdf), _students_df)
+    return result
@@ -0,0 +1,155 @@
+# Sources of student data for the app.
+# The app normally reads the private Google Sheets file. For offline testing, a local CSV or SQLite file with the same columns can be used instead.
+# If the data has a version column (e.g., an increasing number or timestamp that is updated whenever a row changes), refreshing only fetches the rows that changed since the last sync.
+
+import sqlite3
+import threading
+from time import time
+
+import pandas as pd
+
+def to_python_value(value):
+    """Convert a numpy scalar (e.g., the max of a column) into a plain Python value for use as a query parameter."""
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+class GoogleSheetsSource:
+    """Student data in a private Google Sheets file, read through gsheetsdb.
+The version column, if used, must contain numbers."""
+
+    def __init__(self, conn, sheet_url):
+        self.conn = conn
+        self.sheet_url = sheet_url
+
+    def fetch(self, version_col = None, since = None):
+        """Fetch all rows, or only the rows whose version is above since."""
+        query = f'SELECT * FROM "{self.sheet_url}"'
+
+        if since is not None:
+            query += f' WHERE "{version_col}" > {float(to_python_value(since))}'
+
+        rows = self.conn.execute(
+            query,
+            headers = 1,
+        )
+
+        result = pd.DataFrame(rows)
+        return result
+
+class CSVSource:
+    """Student data in a local CSV file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, version_col = None, since = None):
+        """Fetch all rows, or only the rows whose version is above since."""
+        result = pd.read_csv(self.path)
+
+        if since is not None:
+            result = result.loc[result[version_col] > since]
+
+        return result
+
+class SQLiteSource:
+    """Student data in a table of a local SQLite file."""
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+
+    def fetch(self, version_col = None, since = None):
+        """Fetch all rows, or only the rows whose version is above since."""
+        query = f'SELECT * FROM "{self.table}"'
+        params = ()
+
+        if since is not None:
+            query += f' WHERE "{version_col}" > ?'
+            params = (to_python_value(since),)
+
+        with sqlite3.connect(self.path) as conn:
+            result = pd.read_sql_query(query, conn, params = params)
+
+        return result
+
+class StudentStore:
+    """Student data shared by all sessions, kept in sync with a source.
+
+Without a version column, every sync fetches the whole roster. With one, a sync only fetches the rows whose version is above the highest version seen so far and merges them into the data by student_number. If deleted_col is set, rows where it is true are removed.
+
+data_version increases whenever the data changes. It can be used as a cache key instead of hashing the whole roster."""
+
+    int_cols = ["student_number", "grade_level"]
+
+    def __init__(self, source, version_col = None, deleted_col = None, ttl = None):
+        self.source = source
+        self.version_col = version_col
+        self.deleted_col = deleted_col
+        self.ttl = ttl
+
+        self.students_df = None
+        self.last_version = None
+        self.last_sync_time = None
+        self.data_version = 0
+
+        # Sessions may sync at the same time.
+        # get() holds the lock while it syncs, so the lock must be reentrant.
+        self.lock = threading.RLock()
+
+    def clean(self, df):
+        """Give the fetched columns their proper types."""
+        for col in self.int_cols:
+            df[col] = df[col].astype(int)
+        return df
+
+    def sync(self):
+        """Fetch new data from the source and merge it into the stored data."""
+        with self.lock:
+            incremental = (self.version_col is not None) and (self.students_df is not None)
+
+            if incremental:
+                changes_df = self.source.fetch(version_col = self.version_col, since = self.last_version)
+
+                if changes_df.shape[0] > 0:
+                    changes_df = self.clean(changes_df)
+
+                    # Changed rows replace the old rows of the same students.
+                    students_df = (
+                        pd.concat([self.students_df, changes_df], axis = 0)
+                        .drop_duplicates(subset = "student_number", keep = "last")
+                    )
+                else:
+                    students_df = None
+
+            else:
+                changes_df = self.clean(self.source.fetch())
+                students_df = changes_df
+
+            if students_df is not None:
+                if self.deleted_col is not None:
+                    students_df = students_df.loc[~students_df[self.deleted_col].astype(bool)]
+
+                if self.version_col is not None:
+                    self.last_version = changes_df[self.version_col].max()
+
+                self.students_df = students_df.reset_index(drop = True)
+                self.data_version += 1
+
+            self.last_sync_time = time()
+
+    def get(self):
+        """Return a tuple of (student data, data_version), syncing first if it has never been synced or is older than ttl seconds.
+Both are read under the lock, so the version always belongs to the data it is returned with, even if another session syncs at the same time."""
+        with self.lock:
+            expired = (
+                (self.last_sync_time is None)
+                or ((self.ttl is not None) and (time() - self.last_sync_time > self.ttl))
+            )
+
+            if expired:
+                self.sync()
+
+            result = (self.students_df, self.data_version)
+
+        return result
@@ -5,6 +5,8 @@ import numpy as np
 import fiona
 import geopandas as gpd
 
+from gadm_artifact import write_artifact
+
 #%%
 # Determine the finest layer. 3 is barangay, 2 is city, 1 is province.
 finest_layer = 2
@@ -24,4 +26,14 @@ print("\nGADM: ", gdf.columns.tolist())
 
 #%%
 # Save table of locations without map configuration data as CSV
-gdf.drop("geometry", axis = 1).to_csv("./private/cleaning_outputs/gadm_all_locations.csv")
\ No newline at end of file
+gdf.drop("geometry", axis = 1).to_csv("./private/cleaning_outputs/gadm_all_locations.csv")
+
+#%%
+# Build the columnar copy of every GADM layer, which the app and the matching program read instead of the GPKG.
+# This also builds the simplified copies of the geometries used by the app's maps, which takes a while for the finer levels.
+# Run this cell again whenever the GPKG is replaced.
+for layer in layers:
+    level = int(layer.rsplit("_", 1)[-1])
+    layer_gdf = gpd.read_file(gpkg, layer = layer)
+    write_artifact(layer_gdf, level)
+    print(f"Saved columnar and simplified copies of {layer}: {layer_gdf.shape[0]} rows")
@@ -0,0 +1,197 @@
+# Columnar copy of the GADM layers, built by convert_gadm_data.py.
+# Attribute columns are saved as Parquet and geometries as WKB in a separate file.
+# This way, the attributes can be read without parsing any geometry, and the geometries are only decoded when a map needs them.
+# Simplified copies of the geometries, used by the maps of the app, are also built here so that the app never simplifies anything itself.
+# If the columnar copy has not been built, everything is read from the GPKG instead.
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+gpkg = "./geo_data/gadm36_PHL.gpkg"
+artifact_dir = "./geo_data/columnar"
+
+# Simplification tolerances in degrees (0.001 degrees is about 110 m) of the simplified copies.
+simplify_tolerances = (0.0005, 0.002, 0.005)
+
+def get_paths(level, directory = artifact_dir):
+    """Paths of the files that make up the columnar copy of a level."""
+    stem = os.path.join(directory, f"gadm36_PHL_{level}")
+    paths = {
+        "attributes": stem + ".parquet",
+        "wkb": stem + ".wkb",
+        "offsets": stem + "_offsets.npy",
+        "meta": stem + ".json",
+    }
+    return paths
+
+def get_simplified_paths(level, tolerance, directory = artifact_dir):
+    """Paths of the WKB and offsets files of the geometries of a level, simplified with the given tolerance."""
+    stem = os.path.join(directory, f"gadm36_PHL_{level}_simplified_{tolerance}")
+    paths = {
+        "wkb": stem + ".wkb",
+        "offsets": stem + "_offsets.npy",
+    }
+    return paths
+
+def artifact_exists(level, directory = artifact_dir):
+    """Whether the columnar copy of a level has been built."""
+    result = all(os.path.exists(path) for path in get_paths(level, directory).values())
+    return result
+
+def write_wkb(geometry, wkb_path, offsets_path):
+    """Save a GeoSeries as a WKB file and an offsets file.
+The WKB file holds the geometries back to back. The offsets file holds where each one starts, plus the end of the last one."""
+    wkb_lst = geometry.to_wkb().tolist()
+
+    offsets = np.zeros(len(wkb_lst) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(wkb) for wkb in wkb_lst])
+    np.save(offsets_path, offsets)
+
+    with open(wkb_path, "wb") as file:
+        for wkb in wkb_lst:
+            file.write(wkb)
+
+def read_wkb(wkb_path, offsets_path, crs):
+    """Read a GeoSeries saved by write_wkb()."""
+    # Memory-map the WKB file so that only the bytes being decoded are read from disk.
+    offsets = np.load(offsets_path, mmap_mode = "r")
+    data = np.memmap(wkb_path, dtype = np.uint8, mode = "r")
+
+    wkb_lst = [
+        data[offsets[i]:offsets[i + 1]].tobytes()
+        for i in range(len(offsets) - 1)
+    ]
+
+    result = gpd.GeoSeries.from_wkb(wkb_lst, crs = crs)
+    return result
+
+def simplify_coverage(geometry, tolerances = simplify_tolerances):
+    """Simplify a GeoSeries of areas that share borders (a coverage), once per tolerance.
+Simplifying each polygon by itself moves the two sides of a shared border differently, which leaves gaps and overlaps between neighboring areas. Instead, the borders are found once with topojson, and each border is simplified once for both areas that share it.
+Returns a dictionary mapping each tolerance to a GeoSeries in the same order and with the same index as geometry."""
+    import topojson
+
+    gdf = gpd.GeoDataFrame(
+        {"position": np.arange(len(geometry))},
+        geometry = geometry.to_numpy(),
+        crs = geometry.crs,
+    )
+
+    # prequantize = False keeps the original coordinates. The borders shared by areas are only computed here, not for each tolerance.
+    topology = topojson.Topology(gdf, prequantize = False)
+
+    result = {}
+    for tolerance in tolerances:
+        simplified = (
+            topology
+            .toposimplify(tolerance)
+            .to_gdf()
+            .sort_values("position")
+        )
+
+        result[tolerance] = gpd.GeoSeries(
+            simplified.geometry.to_numpy(),
+            index = geometry.index,
+            crs = geometry.crs,
+        )
+
+    return result
+
+def write_artifact(gdf, level, directory = artifact_dir, tolerances = simplify_tolerances):
+    """Save a GADM layer as a Parquet file of attributes and a WKB file of geometries (see write_wkb()).
+The simplified copies of the geometries, one per tolerance, are saved in the same way."""
+
+    os.makedirs(directory, exist_ok = True)
+    paths = get_paths(level, directory)
+
+    geometry_name = gdf.geometry.name
+
+    attributes = pd.DataFrame(gdf.drop(columns = geometry_name))
+    attributes.to_parquet(paths["attributes"], index = False)
+
+    write_wkb(gdf.geometry, paths["wkb"], paths["offsets"])
+
+    for tolerance, simplified in simplify_coverage(gdf.geometry, tolerances).items():
+        simplified_paths = get_simplified_paths(level, tolerance, directory)
+        write_wkb(simplified, simplified_paths["wkb"], simplified_paths["offsets"])
+
+    meta = {
+        "layer": f"gadm36_PHL_{level}",
+        "n_rows": gdf.shape[0],
+        "crs": gdf.crs.to_wkt() if gdf.crs is not None else None,
+        "simplify_tolerances": list(tolerances),
+    }
+
+    with open(paths["meta"], "w") as file:
+        json.dump(meta, file, indent = 4)
+
+def read_attributes(level, directory = artifact_dir):
+    """Read the attribute columns (GIDs, names, etc.) of a GADM layer as a DataFrame, without any geometry."""
+    if artifact_exists(level, directory):
+        result = pd.read_parquet(get_paths(level, directory)["attributes"])
+    else:
+        gdf = gpd.read_file(gpkg, layer = f"gadm36_PHL_{level}")
+        result = pd.DataFrame(gdf.drop(columns = gdf.geometry.name))
+
+    return result
+
+def read_geometry(level, index = None, directory = artifact_dir):
+    """Read the geometries of a GADM layer as a GeoSeries, in the same row order as read_attributes().
+If index is given, it becomes the index of the GeoSeries."""
+    if artifact_exists(level, directory):
+        paths = get_paths(level, directory)
+
+        with open(paths["meta"]) as file:
+            meta = json.load(file)
+
+        result = read_wkb(paths["wkb"], paths["offsets"], meta["crs"])
+    else:
+        result = gpd.read_file(gpkg, layer = f"gadm36_PHL_{level}").geometry
+
+    if index is not None:
+        result.index = index
+
+    return result
+
+def read_simplified_geometry(level, tolerances = simplify_tolerances, index = None, directory = artifact_dir):
+    """Read the simplified copies of the geometries of a GADM layer, in the same row order as read_attributes().
+Returns a dictionary mapping each tolerance to a GeoSeries. If index is given, it becomes the index of each GeoSeries.
+Copies that were not built by convert_gadm_data.py are simplified here instead, which is much slower."""
+    result = {}
+    missing = []
+
+    for tolerance in tolerances:
+        paths = get_simplified_paths(level, tolerance, directory)
+
+        if artifact_exists(level, directory) and all(os.path.exists(path) for path in paths.values()):
+            with open(get_paths(level, directory)["meta"]) as file:
+                meta = json.load(file)
+
+            result[tolerance] = read_wkb(paths["wkb"], paths["offsets"], meta["crs"])
+        else:
+            missing.append(tolerance)
+
+    if len(missing) > 0:
+        result.update(simplify_coverage(read_geometry(level, directory = directory), missing))
+
+    result = {tolerance: result[tolerance] for tolerance in tolerances}
+
+    if index is not None:
+        for simplified in result.values():
+            simplified.index = index
+
+    return result
+
+def read_gdf(level, directory = artifact_dir):
+    """Read a GADM layer as a GeoDataFrame with both attributes and geometry."""
+    if artifact_exists(level, directory):
+        attributes = read_attributes(level, directory)
+        geometry = read_geometry(level, index = attributes.index, directory = directory)
+        result = gpd.GeoDataFrame(attributes, geometry = geometry)
+    else:
+        result = gpd.read_file(gpkg, layer = f"gadm36_PHL_{level}")
+
+    return result
@@ -0,0 +1,67 @@
+# Spatial queries against the GADM geometries.
+# Each query goes through the spatial index (an STRtree when pygeos is installed) of the GADM GeoSeries, so only the areas whose bounding boxes touch the query geometries are tested exactly.
+# Results are row positions in the GADM layer, which are also the codes used by the app's GidIndex.
+
+import numpy as np
+
+# Projected CRS used for areas and distances. UTM zone 51N covers most of the Philippines with little distortion.
+projected_crs = "EPSG:32651"
+
+# CRS assumed for uploaded data that does not specify one.
+default_crs = "EPSG:4326"
+
+def set_default_crs(gs):
+    """Give a GeoSeries or GeoDataFrame the default CRS (longitude and latitude) if it has none."""
+    if gs.crs is None:
+        gs = gs.set_crs(default_crs)
+    return gs
+
+def points_to_areas(geometry, points):
+    """Find the area that contains each point.
+geometry is the GeoSeries of a GADM layer. points is a GeoSeries of points.
+Returns an array with the row position of the containing area for each point, or -1 if the point is outside every area.
+A point on the border of two areas is assigned to the area that comes first in the GADM layer."""
+    points = set_default_crs(points).to_crs(geometry.crs)
+
+    # Pairs of (point position, area position), where the area intersects the point.
+    point_pos, area_pos = geometry.sindex.query_bulk(points.values, predicate = "intersects")
+
+    result = np.full(len(points), -1, dtype = np.int64)
+
+    # Sort the pairs by point, then by area, and keep the first pair of each point.
+    order = np.lexsort((area_pos, point_pos))
+    point_pos = point_pos[order]
+    area_pos = area_pos[order]
+
+    uniq, first = np.unique(point_pos, return_index = True)
+    result[uniq] = area_pos[first]
+
+    return result
+
+def footprint_to_areas(geometry, footprint, min_overlap = 0):
+    """Find the areas that intersect a hazard footprint.
+geometry is the GeoSeries of a GADM layer. footprint is a GeoSeries of the footprint's polygons.
+If min_overlap is above 0, only areas with at least that fraction of their own area inside the footprint are kept. Areas are measured in the projected CRS.
+Returns a sorted array of the row positions of the areas."""
+    footprint = set_default_crs(footprint).to_crs(geometry.crs)
+
+    footprint_pos, area_pos = geometry.sindex.query_bulk(footprint.values, predicate = "intersects")
+    result = np.unique(area_pos)
+
+    if (min_overlap > 0) and (len(result) > 0):
+        # Only the candidate areas are projected.
+        candidates = geometry.iloc[result].to_crs(projected_crs)
+        footprint_union = footprint.to_crs(projected_crs).unary_union
+
+        overlap = candidates.intersection(footprint_union).area / candidates.area
+        result = result[overlap.to_numpy() >= min_overlap]
+
+    return result
+
+def buffer_points(points, radii_km):
+    """Circles of the given radii (in kilometers) around points.
+They are computed in the projected CRS so that the radii are true distances on the ground. Returns a GeoSeries of polygons in the projected CRS."""
+    points = set_default_crs(points).to_crs(projected_crs)
+
+    result = points.buffer(np.asarray(radii_km, dtype = float) * 1000)
+    return result
@@ -0,0 +1,257 @@
+#%% Import
+
+import os
+import sys
+import json
+import platform
+from datetime import datetime
+from time import perf_counter
+
+import pandas as pd
+import numpy as np
+
+from gadm_artifact import read_attributes
+from matching_preprocess import full_preprocess, clear_memo
+from matching_engine import BlockedMatcher, match_all
+
+#%%
+# Benchmark settings.
+# Synthetic student locations are made from the GADM names themselves, so the correct GID of every student is known.
+# This measures speed and accuracy without the private student data.
+
+# Levels to benchmark. 3 is barangay, 2 is city.
+levels = [2, 3]
+
+# Numbers of synthetic students.
+sizes = [1000, 10000, 100000, 1000000]
+
+# Probability that a name gets a typo (a deleted, inserted, replaced or swapped letter).
+typo_rate = 0.1
+
+# Probability that a name is abbreviated (e.g., "Santo" to "Sto", "Barangay" to "Brgy").
+abbreviation_rate = 0.3
+
+# Probability that " City" is left out of a city name.
+drop_city_rate = 0.5
+
+seed = 0
+
+# Matching options, the same as in matching_program.py.
+beam_width = 3
+fallback_threshold = 0.75
+index_limit = 50
+n_workers = os.cpu_count() or 1
+chunk_size = 500
+
+results_path = "./private/cleaning_outputs/matching_benchmark.json"
+
+#%%
+# Synthetic data generation
+
+# Abbreviations of the starts of names, per student column.
+abbreviations = {
+    "province": [],
+    "city_municipality": [
+        ("Santo ", "Sto "),
+        ("Santa ", "Sta "),
+    ],
+    "barangay": [
+        ("Barangay ", "Brgy "),
+        ("Santo ", "Sto "),
+        ("Santa ", "Sta "),
+        ("General ", "Gen "),
+    ],
+}
+
+letters = "abcdefghijklmnopqrstuvwxyz"
+
+def add_typo(text, rng):
+    """Delete, insert, replace, or swap one letter in a name."""
+    if len(text) < 2:
+        return text
+
+    pos = rng.integers(0, len(text) - 1)
+    operation = rng.integers(0, 4)
+    letter = letters[rng.integers(0, len(letters))]
+
+    if operation == 0:
+        result = text[:pos] + text[pos + 1:]
+    elif operation == 1:
+        result = text[:pos] + letter + text[pos:]
+    elif operation == 2:
+        result = text[:pos] + letter + text[pos + 1:]
+    else:
+        result = text[:pos] + text[pos + 1] + text[pos] + text[pos + 2:]
+
+    return result
+
+def make_synthetic_students(gdf, finest_level, n_students, rng):
+    """Sample GADM areas and turn their names into messy student location data.
+The GID of the sampled area is kept in the true_gid column."""
+
+    label_series = pd.Series(
+        {
+            "province": "NAME_1",
+            "city_municipality": "NAME_2",
+            "barangay": "NAME_3",
+        }
+    ).iloc[:finest_level]
+
+    gid_label = f"GID_{finest_level}"
+
+    positions = rng.integers(0, gdf.shape[0], size = n_students)
+    sampled = gdf.iloc[positions]
+
+    student_df = pd.DataFrame(
+        {
+            "student_number": np.arange(1, n_students + 1),
+            "true_gid": sampled[gid_label].to_numpy(),
+        }
+    )
+
+    for s_label, g_label in label_series.items():
+        names = sampled[g_label].tolist()
+        messy_names = []
+
+        for name in names:
+            if s_label == "city_municipality" and name.endswith(" City") and rng.random() < drop_city_rate:
+                name = name[:-len(" City")]
+
+            if rng.random() < abbreviation_rate:
+                for long_form, short_form in abbreviations[s_label]:
+                    if name.startswith(long_form):
+                        name = short_form + name[len(long_form):]
+                        break
+
+            if rng.random() < typo_rate:
+                name = add_typo(name, rng)
+
+            messy_names.append(name)
+
+        student_df[s_label] = messy_names
+
+    return student_df
+
+#%%
+# Run the benchmark.
+
+rng = np.random.default_rng(seed)
+results = []
+
+for finest_level in levels:
+    gdf = read_attributes(finest_level)
+
+    if finest_level == 3:
+        gdf = gdf.loc[gdf["NAME_3"] != "n.a."]
+
+    gdf = gdf.reset_index(drop = True)
+
+    label_series = pd.Series(
+        {
+            "province": "NAME_1",
+            "city_municipality": "NAME_2",
+            "barangay": "NAME_3",
+        }
+    ).iloc[:finest_level]
+
+    s_label_lst = label_series.index.tolist()
+    g_label_lst = label_series.tolist()
+    gid_label = f"GID_{finest_level}"
+
+    # GADM preprocessing and the matcher are shared by every size.
+    clear_memo()
+    t_start = perf_counter()
+    gadm_df_pp = full_preprocess(gdf, g_label_lst)
+    t_gadm_preprocess = perf_counter() - t_start
+
+    t_start = perf_counter()
+    matcher = BlockedMatcher(
+        gadm_df_pp,
+        g_label_lst,
+        beam_width = beam_width,
+        fallback_threshold = fallback_threshold,
+        index_path = f"./geo_data/gadm36_PHL_{finest_level}_qgram.pkl",
+        index_limit = index_limit,
+    )
+    t_matcher_setup = perf_counter() - t_start
+
+    for n_students in sizes:
+        student_df = make_synthetic_students(gdf, finest_level, n_students, rng)
+
+        # Time student preprocessing from scratch.
+        clear_memo()
+        t_start = perf_counter()
+        student_df_pp = full_preprocess(student_df, ["student_number"] + s_label_lst)
+        t_student_preprocess = perf_counter() - t_start
+
+        # Time matching, the same way as matching_program.py: each distinct location is matched once.
+        t_start = perf_counter()
+
+        loc_df = (
+            student_df_pp[s_label_lst]
+            .drop_duplicates()
+            .reset_index(drop = True)
+        )
+
+        match_results = match_all(
+            matcher,
+            loc_df.values.tolist(),
+            n_workers = n_workers,
+            chunk_size = chunk_size,
+        )
+
+        loc_df["g_index"] = [g_index for g_index, score in match_results]
+
+        student_matches = student_df_pp[s_label_lst].merge(
+            loc_df,
+            how = "left",
+            on = s_label_lst,
+        )
+
+        t_match = perf_counter() - t_start
+
+        predicted_gids = gdf[gid_label].to_numpy()[student_matches["g_index"].to_numpy()]
+        accuracy = float(np.mean(predicted_gids == student_df["true_gid"].to_numpy()))
+
+        result = {
+            "finest_level": finest_level,
+            "n_students": n_students,
+            "n_distinct_locations": int(loc_df.shape[0]),
+            "n_gadm_rows": int(gdf.shape[0]),
+            "gadm_preprocess_s": t_gadm_preprocess,
+            "matcher_setup_s": t_matcher_setup,
+            "student_preprocess_s": t_student_preprocess,
+            "match_s": t_match,
+            "students_per_s": n_students / t_match if t_match > 0 else None,
+            "accuracy": accuracy,
+        }
+
+        results.append(result)
+        print(result)
+
+#%%
+# Save the results.
+
+output = {
+    "timestamp": datetime.now().isoformat(timespec = "seconds"),
+    "python": sys.version,
+    "platform": platform.platform(),
+    "cpu_count": os.cpu_count(),
+    "settings": {
+        "typo_rate": typo_rate,
+        "abbreviation_rate": abbreviation_rate,
+        "drop_city_rate": drop_city_rate,
+        "seed": seed,
+        "beam_width": beam_width,
+        "fallback_threshold": fallback_threshold,
+        "index_limit": index_limit,
+        "n_workers": n_workers,
+        "chunk_size": chunk_size,
+    },
+    "results": results,
+}
+
+with open(results_path, "w") as file:
+    json.dump(output, file, indent = 4)
+
+pd.DataFrame(results)
@@ -0,0 +1,100 @@
+# Persistent cache of location matches used by matching_program.py.
+# Maps each preprocessed student location to the GID and score it was matched to, so repeated runs only match new locations.
+
+import sqlite3
+import hashlib
+from time import time
+
+def make_version(*parts):
+    """Combine everything that affects a match (GADM layer, preprocessing, matcher settings) into one version string."""
+    hasher = hashlib.sha1()
+    for part in parts:
+        hasher.update(repr(part).encode("utf-8"))
+        hasher.update(b"\x1f")
+    return hasher.hexdigest()
+
+class MatchCache:
+    """SQLite cache mapping (version, location) to the matched GID and score.
+Entries of other versions are never returned. When there are more than max_entries entries, the least recently used ones are deleted."""
+
+    # Number of locations per SQL query, below SQLite's limit on query parameters.
+    batch_size = 400
+
+    def __init__(self, path, version, max_entries = 200000):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS matches (
+                version TEXT NOT NULL,
+                location TEXT NOT NULL,
+                gid TEXT NOT NULL,
+                score REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (version, location)
+            )"""
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def location_key(location):
+        """Text key of a location tuple, such as (province, city_municipality)."""
+        return "\x1f".join(location)
+
+    def get_many(self, locations):
+        """Look up location tuples. Returns a dictionary mapping each cached location to its (gid, score)."""
+        keys = {self.location_key(loc): loc for loc in locations}
+        key_lst = list(keys)
+
+        result = {}
+        for start in range(0, len(key_lst), self.batch_size):
+            batch = key_lst[start:start + self.batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT location, gid, score FROM matches WHERE version = ? AND location IN ({placeholders})",
+                [self.version] + batch,
+            )
+            for key, gid, score in rows:
+                result[keys[key]] = (gid, score)
+
+        # Mark the hits as recently used.
+        now = time()
+        self.conn.executemany(
+            "UPDATE matches SET last_used = ? WHERE version = ? AND location = ?",
+            [(now, self.version, self.location_key(loc)) for loc in result],
+        )
+        self.conn.commit()
+
+        return result
+
+    def put_many(self, matches):
+        """Save matches, given as a dictionary mapping location tuples to (gid, score). Then enforce max_entries."""
+        now = time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO matches (version, location, gid, score, last_used) VALUES (?, ?, ?, ?, ?)",
+            [
+                (self.version, self.location_key(loc), gid, float(score), now)
+                for loc, (gid, score) in matches.items()
+            ],
+        )
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """Delete the least recently used entries beyond max_entries."""
+        n_entries = self.conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+        n_excess = n_entries - self.max_entries
+
+        if n_excess > 0:
+            self.conn.execute(
+                "DELETE FROM matches WHERE rowid IN (SELECT rowid FROM matches ORDER BY last_used LIMIT ?)",
+                (n_excess,),
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,336 @@
+# Matching engine used by matching_program.py.
+# Student locations are matched to GADM areas one administrative level at a time, so each level only scores the areas inside the chosen parent areas instead of every GADM row.
+
+import os
+import sys
+import pickle
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+import numpy as np
+import Levenshtein
+
+def get_qgrams(text, q):
+    """Set of character q-grams of a string. The string is padded so that its start and end form their own q-grams."""
+    padded = " " * (q - 1) + text + " "
+    result = {padded[i:i + q] for i in range(len(padded) - q + 1)}
+    return result
+
+class QGramIndex:
+    """Character q-gram inverted index over the unique names of each level of a BlockedMatcher.
+Used to find a short list of candidate names before any Levenshtein scoring."""
+
+    def __init__(self, level_names, q = 3):
+        self.q = q
+        self.fingerprint = self.get_fingerprint(level_names, q)
+
+        # Per level, a dictionary mapping each q-gram to the sorted array of names (by position in the level's name list) that contain it.
+        self.postings = []
+        for names in level_names:
+            gram_lists = {}
+            for code, name in enumerate(names):
+                for gram in get_qgrams(name, q):
+                    gram_lists.setdefault(gram, []).append(code)
+
+            self.postings.append(
+                {
+                    gram: np.array(lst, dtype = np.int64)
+                    for gram, lst in gram_lists.items()
+                }
+            )
+
+    @staticmethod
+    def get_fingerprint(level_names, q):
+        """Hash of the indexed names, used to detect a stale index file."""
+        hasher = hashlib.sha1(str(q).encode("utf-8"))
+        for names in level_names:
+            hasher.update("\x1e".join(names).encode("utf-8"))
+            hasher.update(b"\x1d")
+        return hasher.hexdigest()
+
+    @classmethod
+    def load_or_build(cls, path, level_names, q = 3):
+        """Load the index saved at path. If it is missing or was built from different names, build it and save it."""
+        fingerprint = cls.get_fingerprint(level_names, q)
+
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                index = pickle.load(file)
+
+            if isinstance(index, cls) and index.fingerprint == fingerprint:
+                return index
+
+        index = cls(level_names, q = q)
+
+        with open(path, "wb") as file:
+            pickle.dump(index, file, protocol = pickle.HIGHEST_PROTOCOL)
+
+        return index
+
+    def lookup(self, level, text, limit):
+        """Positions of the names at a level that share the most q-grams with text, at most limit of them, in ascending order."""
+        postings = self.postings[level]
+        hits = [postings[gram] for gram in get_qgrams(text, self.q) if gram in postings]
+
+        if len(hits) == 0:
+            return np.array([], dtype = np.int64)
+
+        codes, counts = np.unique(np.concatenate(hits), return_counts = True)
+
+        if len(codes) > limit:
+            # Keep the names with the most shared q-grams. Stable sorting keeps alphabetical order among ties.
+            top = np.argsort(-counts, kind = "stable")[:limit]
+            codes = np.sort(codes[top])
+
+        return codes
+
+class BlockedMatcher:
+    """Hierarchy-blocked matcher over preprocessed GADM names.
+
+Provinces are scored against every province. Each finer level is only scored among the children of the beam_width best parents. If the best ratio at a level is below fallback_threshold, every area at that level is scored instead, so a misspelled province does not hide the correct city.
+
+If index_path is set, a QGramIndex of the unique names of each level is loaded from (or saved to) that file. The wide path then only scores the areas whose names are among the index_limit names that share the most q-grams with the student's name. Every area with one of those names is scored, whatever its parent areas, so a common name like "poblacion" does not favor the areas that come first in GADM.
+
+Without an index, a fallback_threshold above 1 always takes the wide path, which gives the same result as scoring every GADM row."""
+
+    def __init__(self, gadm_df_pp, g_label_lst, beam_width = 3, fallback_threshold = 0.75, index_path = None, index_limit = 50):
+        self.g_label_lst = list(g_label_lst)
+        self.beam_width = beam_width
+        self.fallback_threshold = fallback_threshold
+        self.index_limit = index_limit
+
+        n_levels = len(self.g_label_lst)
+        self.n_levels = n_levels
+
+        # A "group" at level l is a distinct tuple of names from NAME_1 down to NAME_l.
+        # Per level, names holds the name of each group and parents holds the index of its parent group.
+        group_lookup = [{} for _ in range(n_levels)]
+        name_lists = [[] for _ in range(n_levels)]
+        parent_lists = [[] for _ in range(n_levels)]
+
+        # Position (in gadm_df_pp) of the first row of each finest-level group.
+        # When two rows share the same names, the first row wins, as in a full scan.
+        first_row_lst = []
+
+        columns = [gadm_df_pp[label].tolist() for label in self.g_label_lst]
+
+        for row_pos, row_names in enumerate(zip(*columns)):
+            parent = -1
+            for level in range(n_levels):
+                key = row_names[:level + 1]
+                group = group_lookup[level].get(key)
+
+                if group is None:
+                    group = len(name_lists[level])
+                    group_lookup[level][key] = group
+                    name_lists[level].append(row_names[level])
+                    parent_lists[level].append(parent)
+
+                    if level == n_levels - 1:
+                        first_row_lst.append(row_pos)
+
+                parent = group
+
+        self.names = [np.array(lst, dtype = object) for lst in name_lists]
+        self.parents = [np.array(lst, dtype = np.int64) for lst in parent_lists]
+        self.first_row = np.array(first_row_lst, dtype = np.int64)
+
+        # Children of each group, used to expand the kept parents into candidates.
+        self.children = []
+        for level in range(n_levels - 1):
+            child_lists = [[] for _ in range(len(name_lists[level]))]
+            for child, parent in enumerate(parent_lists[level + 1]):
+                child_lists[parent].append(child)
+
+            self.children.append([np.array(lst, dtype = np.int64) for lst in child_lists])
+
+        # Many areas share names (e.g., "poblacion"), so wide scoring is done per unique name.
+        self.unique_names = []
+        self.name_codes = []
+        for names in self.names:
+            unique_names, name_codes = np.unique(names.astype(str), return_inverse = True)
+            self.unique_names.append(unique_names)
+            self.name_codes.append(name_codes)
+
+        # Groups of each unique name. The groups of name code c are name_groups[name_starts[c]:name_starts[c + 1]].
+        self.name_groups = []
+        self.name_starts = []
+        for unique_names, name_codes in zip(self.unique_names, self.name_codes):
+            self.name_groups.append(np.argsort(name_codes, kind = "stable"))
+            self.name_starts.append(np.searchsorted(np.sort(name_codes), np.arange(len(unique_names) + 1)))
+
+        if index_path is None:
+            self.index = None
+        else:
+            self.index = QGramIndex.load_or_build(
+                index_path,
+                [unique_names.tolist() for unique_names in self.unique_names],
+            )
+
+    def _ratios(self, level, groups, s_text):
+        """Levenshtein ratios of s_text against the names of the given groups at a level."""
+        names = self.names[level]
+        result = np.array(
+            [Levenshtein.ratio(names[g], s_text) for g in groups],
+            dtype = float,
+        )
+        return result
+
+    def _wide_scores(self, level, s_names, wide_cache):
+        """Cumulative scores of every group at a level, computed from the top level down.
+wide_cache holds the results already computed for the current student."""
+        if level in wide_cache:
+            return wide_cache[level]
+
+        s_text = s_names[level]
+        unique_ratios = np.array(
+            [Levenshtein.ratio(name, s_text) for name in self.unique_names[level]],
+            dtype = float,
+        )
+        scores = unique_ratios[self.name_codes[level]]
+
+        if level > 0:
+            parent_scores = self._wide_scores(level - 1, s_names, wide_cache)
+            scores = parent_scores[self.parents[level]] + scores
+
+        wide_cache[level] = scores
+        return scores
+
+    def _groups_with_names(self, level, codes):
+        """All groups at a level whose names have the given name codes, in ascending order."""
+        starts = self.name_starts[level][codes]
+        lengths = self.name_starts[level][codes + 1] - starts
+
+        # Positions in name_groups of the groups of every name.
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+        result = np.sort(self.name_groups[level][positions])
+        return result
+
+    def _path_scores(self, level, groups, s_names):
+        """Cumulative scores of the given groups at a level, scoring only their own ancestors."""
+        # Ancestors of each group, from the top level down.
+        path = [groups]
+        for upper_level in range(level, 0, -1):
+            path.insert(0, self.parents[upper_level][path[0]])
+
+        scores = self._ratios(0, path[0], s_names[0])
+        for path_level in range(1, level + 1):
+            scores = scores + self._ratios(path_level, path[path_level], s_names[path_level])
+
+        return scores
+
+    def match(self, s_names):
+        """Find the best GADM match for one student.
+s_names is the list of the student's preprocessed location names, from province downwards.
+Returns the position of the matched row in gadm_df_pp and its total score."""
+
+        wide_cache = {}
+
+        # Every province is a candidate.
+        candidates = np.arange(len(self.names[0]))
+        scores = self._wide_scores(0, s_names, wide_cache)
+
+        for level in range(1, self.n_levels):
+            # Keep the best parents. Stable sorting keeps GADM order among ties.
+            order = np.argsort(-scores, kind = "stable")[:self.beam_width]
+            kept = candidates[order]
+            kept_scores = scores[order]
+
+            # Expand the kept parents into their children.
+            child_arrays = [self.children[level - 1][g] for g in kept]
+            candidates = np.concatenate(child_arrays)
+            inherited = np.repeat(kept_scores, [len(arr) for arr in child_arrays])
+
+            ratios = self._ratios(level, candidates, s_names[level])
+
+            if len(ratios) > 0 and ratios.max() >= self.fallback_threshold:
+                scores = inherited + ratios
+
+            else:
+                # The blocked candidates look wrong, so search the whole level.
+                # With an index, only the areas whose names share the most q-grams are scored.
+                if self.index is not None:
+                    codes = self.index.lookup(level, s_names[level], self.index_limit)
+                    candidates = self._groups_with_names(level, codes)
+                else:
+                    candidates = np.array([], dtype = np.int64)
+
+                if len(candidates) > 0:
+                    scores = self._path_scores(level, candidates, s_names)
+                else:
+                    candidates = np.arange(len(self.names[level]))
+                    scores = self._wide_scores(level, s_names, wide_cache)
+
+        # Highest score wins. Among ties, the area that comes first in GADM wins.
+        rows = self.first_row[candidates]
+        best = np.lexsort((rows, -scores))[0]
+
+        return int(rows[best]), float(scores[best])
+
+# Matcher used by each worker process. It is set once per worker by _init_worker() so that the GADM arrays are not sent with every chunk.
+_worker_matcher = None
+
+def _init_worker(matcher):
+    global _worker_matcher
+    _worker_matcher = matcher
+
+def _match_chunk(chunk):
+    """Match a chunk of students in a worker process. Returns the results and the time taken."""
+    t_start = perf_counter()
+    results = [_worker_matcher.match(s_names) for s_names in chunk]
+    t_elapsed = perf_counter() - t_start
+    return results, t_elapsed
+
+def match_all(matcher, name_rows, n_workers = 1, chunk_size = 500):
+    """Match every student in name_rows, a list of preprocessed location name lists.
+If n_workers is above 1, chunks of chunk_size students are matched in parallel worker processes, using at most one worker per chunk.
+Returns a list of (row position, score) tuples in the same order as name_rows."""
+
+    chunks = [
+        name_rows[start:start + chunk_size]
+        for start in range(0, len(name_rows), chunk_size)
+    ]
+
+    # There is no use in starting more workers than there are chunks. With one chunk or none, the pool is skipped.
+    n_workers = min(n_workers, len(chunks))
+
+    if n_workers > 1:
+        if "fork" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("fork")
+
+        elif hasattr(sys.modules["__main__"], "__file__"):
+            # Without fork, every worker re-runs the main script, which would start the matching again inside each worker.
+            # Running cells interactively does not have this problem.
+            print("Parallel matching is unavailable when running the script directly on this platform. Matching on one core.")
+            n_workers = 1
+
+        else:
+            mp_context = multiprocessing.get_context("spawn")
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers = n_workers,
+            mp_context = mp_context,
+            initializer = _init_worker,
+            initargs = (matcher,),
+        ) as executor:
+            # map() returns the chunks in submission order, so the results stay in student order.
+            chunk_outputs = executor.map(_match_chunk, chunks)
+
+            results = []
+            for chunk_num, (chunk_results, t_elapsed) in enumerate(chunk_outputs):
+                print(f"Chunk {chunk_num + 1} of {len(chunks)}: {len(chunk_results)} students in {t_elapsed} s")
+                results.extend(chunk_results)
+
+    else:
+        _init_worker(matcher)
+
+        results = []
+        for chunk_num, chunk in enumerate(chunks):
+            chunk_results, t_elapsed = _match_chunk(chunk)
+            print(f"Chunk {chunk_num + 1} of {len(chunks)}: {len(chunk_results)} students in {t_elapsed} s")
+            results.extend(chunk_results)
+
+    return results
@@ -0,0 +1,143 @@
+# Text preprocessing of student and GADM location names, used by matching_program.py.
+# Every distinct name is normalized once with precompiled patterns, and the results are memoized so that repeated names and repeated runs are lookups.
+
+import os
+import re
+import pickle
+import hashlib
+import pandas as pd
+
+# Characters removed from every location name.
+removed_chars = ".,'-"
+
+_removal_table = str.maketrans("", "", removed_chars)
+
+_saint_pattern = r"^((sto)|(sta)|(san)|(santo)|(santa))\b"
+
+# Custom preprocessing steps per column, as (pattern, replacement) pairs applied in order after the standard steps.
+# The steps are kept separate instead of joined into one pattern because later steps depend on earlier ones (e.g., "brgy sto nino" must lose "brgy " before "sto" is replaced).
+# Note to self: after custom preprocessing, the text is stripped.
+preprocess_rules = {
+    "province": [],
+    "city_municipality": [
+        (r" city$", ""),
+        (_saint_pattern, "saint"),
+    ],
+    "barangay": [
+        (r"^((barangay)|(brgy)) ", ""),
+        (_saint_pattern, "saint"),
+        (r"^[gh]en.?\b", "general"),
+    ],
+    "NAME_1": [
+        (r"^metropolitan manila$", "metro manila"),
+    ],
+    "NAME_2": [
+        (r" city$", ""),
+        (_saint_pattern, "saint"),
+    ],
+    "NAME_3": [
+        (r"^((barangay)|(bgy)|(bgy no)) ", ""),
+        (_saint_pattern, "saint"),
+    ],
+}
+
+_compiled_rules = {
+    col: [(re.compile(pattern), replacement) for pattern, replacement in rules]
+    for col, rules in preprocess_rules.items()
+}
+
+# Normalized text of every name seen so far, per column.
+_memo = {col: {} for col in preprocess_rules}
+
+def get_rules_fingerprint():
+    """Hash of the preprocessing rules. Changing a rule changes the fingerprint."""
+    text = repr((removed_chars, sorted(preprocess_rules.items())))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def normalize_text(text, col):
+    """Preprocess one location name from a column. Non-text values become NaN."""
+    if not isinstance(text, str):
+        return float("nan")
+
+    # Standard preprocessing
+    result = (
+        text
+        .strip()
+        .translate(_removal_table)
+        .lower()
+        .replace("ñ", "n")
+    )
+
+    # Column-specific preprocessing
+    for pattern, replacement in _compiled_rules[col]:
+        result = pattern.sub(replacement, result)
+
+    return result.strip()
+
+def normalize_series(series):
+    """Preprocess a location Series, normalizing each distinct value only once."""
+    col = series.name
+    memo = _memo[col]
+
+    for text in series.unique():
+        if isinstance(text, str) and text not in memo:
+            memo[text] = normalize_text(text, col)
+
+    # Values missing from memo (non-text values) become NaN. Missing values are kept as they are.
+    result = series.map(memo).where(series.notna(), series)
+    return result
+
+def clear_memo():
+    """Forget every memoized name, e.g., to time preprocessing from scratch."""
+    for col_memo in _memo.values():
+        col_memo.clear()
+
+def load_memo(path):
+    """Load memoized names saved by save_memo(), if they were made with the current rules."""
+    if not os.path.exists(path):
+        return
+
+    with open(path, "rb") as file:
+        fingerprint, saved_memo = pickle.load(file)
+
+    if fingerprint == get_rules_fingerprint():
+        for col, col_memo in saved_memo.items():
+            if col in _memo:
+                _memo[col].update(col_memo)
+
+def save_memo(path):
+    """Save the memoized names so that later runs do not have to normalize them again."""
+    with open(path, "wb") as file:
+        pickle.dump((get_rules_fingerprint(), _memo), file, protocol = pickle.HIGHEST_PROTOCOL)
+
+def full_preprocess(df, label_lst, comparison_filename = None):
+    """Fully preprocess a dataset, either student data or GADM.
+Columns without preprocessing rules (e.g., student_number) are returned unchanged.
+If comparison_filename is set, a comparison of the original and preprocessed data will be saved to a file."""
+
+    df_preprocessed = df[label_lst].copy()
+
+    for col in df_preprocessed.columns:
+        if col in preprocess_rules:
+            df_preprocessed[col] = normalize_series(df_preprocessed[col])
+
+    if comparison_filename is not None:
+        # Save a table that compares the original location data to the preprocessed version.
+
+        # Append _preprocessed to labels
+        df_pp_copy = df_preprocessed.copy()
+        df_pp_copy.columns = [
+            label + "_preprocessed"
+            for label in df_preprocessed.columns
+        ]
+
+        # Put the original columns next to the preprocessed ones.
+        df_comparison = pd.concat(
+            [df[label_lst], df_pp_copy],
+            axis = 1,
+        )
+
+        df_comparison.to_csv(f"./private/cleaning_outputs/{comparison_filename}.csv")
+
+    # Only return the preprocessed data.
+    return df_preprocessed
@@ -1,18 +1,20 @@
 #%% Import
 
+import os
 import pandas as pd
 import numpy as np
-import Levenshtein
 import geopandas as gpd
 
+from gadm_artifact import read_attributes, read_geometry
+
 #%%
 # Get data
 # Choose whether to go down to barangay level (3) or only city level (2).
 finest_level = 2
 
-gpkg = "./geo_data/gadm36_PHL.gpkg"
-
-gdf = gpd.read_file(gpkg, layer = f"gadm36_PHL_{finest_level}")
+# Only the GADM attribute columns (GIDs and names) are needed for matching.
+# They are read from the columnar copy made by convert_gadm_data.py, or from the GPKG if there is no columnar copy.
+gdf = read_attributes(finest_level)
 
 if finest_level == 3:
     # Do not include barangays whose name is n.a.
@@ -23,6 +25,18 @@ student_df = pd.read_csv(
     "./private/student_location_data/full_ashs_locations.csv",
 )
 
+# Students may have the latitude and longitude of their home from the enrolment form.
+# These students are assigned to the area that contains their point instead of being matched by name.
+lat_col = "latitude"
+lon_col = "longitude"
+
+if (lat_col in student_df.columns) and (lon_col in student_df.columns):
+    coord_cols = [lat_col, lon_col]
+    has_coords = student_df[coord_cols].notna().all(axis = 1)
+else:
+    coord_cols = []
+    has_coords = pd.Series(False, index = student_df.index)
+
 student_df.head()
 
 #%%
@@ -50,7 +64,8 @@ loc_cols = pd.Series(
 
 loc_cols = loc_cols.loc[:finest_level]
 
-inc_students = student_df.loc[student_df[loc_cols].isnull().any(axis = 1)]
+# Students with coordinates do not need their location names.
+inc_students = student_df.loc[student_df[loc_cols].isnull().any(axis = 1) & ~has_coords]
 
 inc_df = inc_students[["student_number"]].copy()
 
@@ -106,164 +121,278 @@ s_label_lst = label_series.index.tolist()
 # GADM data preprocessing
 g_label_lst = label_series.tolist()
 
-def preprocess_series(series, all_loc_cols):
-    """Perform standard text preprocessing on a Series."""
-    if series.name in all_loc_cols:
-        result = (
-            series
-            .str.strip()
-            .str.replace(r"[\.\,\'\-]", "", regex = True)
-            .str.lower()
-            .str.replace("ñ", "n", regex = False)
-        )
-
-        return result
-    else:
-        return series
-
-# Dictionary of custom preprocessing steps per column
-# Note to self: after custom preprocessing, use .strip()
-preprocess_dct = {
-    "province": lambda series: series,
-    "city_municipality": lambda series: (
-        series
-        .str.replace(r" city$", "", regex = True)
-        .str.replace(r"^((sto)|(sta)|(san)|(santo)|(santa))\b", "saint", regex = True)
-    ),
-    "barangay": lambda series: (
-        series
-        .str.replace(r"^((barangay)|(brgy)) ", "", regex = True)
-        .str.replace(r"^((sto)|(sta)|(san)|(santo)|(santa))\b", "saint", regex = True)
-        .str.replace(r"^[gh]en.?\b", "general", regex = True)
-    ),
-    "NAME_1": lambda series: (
-        series
-        .str.replace(r"^metropolitan manila$", "metro manila", regex = True)
-    ),
-    "NAME_2": lambda series: (
-        series
-        .str.replace(r" city$", "", regex = True)
-        .str.replace(r"^((sto)|(sta)|(san)|(santo)|(santa))\b", "saint", regex = True)
-    ),
-    "NAME_3": lambda series: (
-        series
-        .str.replace(r"^((barangay)|(bgy)|(bgy no)) ", "", regex = True)
-        .str.replace(r"^((sto)|(sta)|(san)|(santo)|(santa))\b", "saint", regex = True)
+from matching_preprocess import full_preprocess, get_rules_fingerprint, load_memo, save_memo
+
+# Names normalized in earlier runs are reused, as long as the preprocessing rules have not changed.
+memo_path = "./private/cleaning_outputs/preprocess_memo.pkl"
+load_memo(memo_path)
+
+# Matching options.
+# Cities and barangays are only scored inside the beam_width best-scoring provinces and cities.
+# If the best score at a level is below fallback_threshold, the whole level is scored instead.
+# The whole-level search only scores the index_limit names that share the most trigrams with the student's name.
+# The trigram index is saved next to the GPKG and rebuilt whenever the preprocessed GADM names change.
+# Set use_index to False and fallback_threshold above 1 to score every GADM row for every student.
+beam_width = 3
+fallback_threshold = 0.75
+use_index = True
+index_limit = 50
+index_path = f"./geo_data/gadm36_PHL_{finest_level}_qgram.pkl"
+
+# Version of the matches. It changes whenever the GADM data, the preprocessing rules or the matching options above change.
+# It versions both the match cache and full_matches.csv.
+from matching_cache import make_version
+
+gadm_fingerprint = int(
+    pd.util.hash_pandas_object(gdf[g_label_lst + [gid_label]], index = False).sum()
+)
+
+cache_version = make_version(
+    f"gadm36_PHL_{finest_level}",
+    gadm_fingerprint,
+    get_rules_fingerprint(),
+    beam_width,
+    fallback_threshold,
+    use_index,
+    index_limit,
+)
+
+# Incremental mode. Students whose number and location columns are the same as in the previous full_matches.csv keep their previous match.
+# Only new students and students whose location changed are matched. Students who are no longer in the student data are dropped.
+# The previous file is ignored if it was made with a different finest_level or version. The version is saved next to it, in matches_version_path.
+incremental = True
+matches_path = "./private/cleaning_outputs/full_matches.csv"
+matches_version_path = "./private/cleaning_outputs/full_matches_version.txt"
+
+info_cols = ["student_number", "strand", "grade_level", "section"]
+match_cols = g_label_lst + [gid_label, "score"]
+
+# Location columns of the output. Changing a student's coordinates also counts as a change of location.
+out_loc_cols = s_label_lst + coord_cols
+
+if os.path.exists(matches_version_path):
+    with open(matches_version_path) as file:
+        prev_version = file.read().strip()
+else:
+    prev_version = None
+
+if incremental and os.path.exists(matches_path) and (prev_version == cache_version):
+    prev_match_df = pd.read_csv(matches_path)
+else:
+    if incremental and os.path.exists(matches_path):
+        print("The previous matches were made with a different version of the GADM data, preprocessing rules or matching options. All students will be matched again.")
+    prev_match_df = pd.DataFrame()
+
+if set(["student_number"] + out_loc_cols + match_cols).issubset(prev_match_df.columns):
+    prev_match_df = prev_match_df.drop_duplicates(subset = "student_number", keep = "first")
+
+    # Compare the student number and location columns as text.
+    key_cols = ["student_number"] + out_loc_cols
+    prev_keys = prev_match_df[key_cols].astype(str)
+    prev_keys["prev_position"] = np.arange(prev_match_df.shape[0])
+
+    diff_df = student_df[key_cols].astype(str).merge(
+        prev_keys,
+        how = "left",
+        on = key_cols,
+    )
+
+    unchanged_mask = diff_df["prev_position"].notna().to_numpy()
+    prev_positions = diff_df.loc[unchanged_mask, "prev_position"].astype(int)
+
+    # Unchanged students keep their previous match. Their other columns (e.g., section) are taken from the current data.
+    kept_match_df = pd.concat(
+        [
+            student_df.loc[unchanged_mask, info_cols + out_loc_cols].reset_index(drop = True),
+            prev_match_df.iloc[prev_positions].loc[:, match_cols].reset_index(drop = True),
+        ],
+        axis = 1,
     )
-}
-
-def full_preprocess(df, label_lst, comparison_filename = None):
-    """Fully preprocess a dataset, either student data or GADM.
-If comparison_filename is set, a comparison of the original and preprocessed data will be saved to a file."""
-
-    # Initial preprocessing
-    df_preprocessed = (
-        df[label_lst]
-        .apply(
-            preprocess_series,
-            all_loc_cols = s_label_lst + g_label_lst,
-            axis = 0,
-        )
+
+    changed_student_df = student_df.loc[~unchanged_mask]
+
+else:
+    kept_match_df = pd.DataFrame(columns = info_cols + out_loc_cols + match_cols)
+    changed_student_df = student_df
+
+print(f"{kept_match_df.shape[0]} students are unchanged. {changed_student_df.shape[0]} students are new or changed.")
+
+# Point-in-polygon assignment of new or changed students with coordinates.
+# All points are looked up at once through the spatial index of the GADM geometries.
+# Their score is finest_level, the same as a perfect name match.
+from time import perf_counter
+
+from gadm_spatial import points_to_areas
+
+point_mask = has_coords.loc[changed_student_df.index].to_numpy()
+point_student_df = changed_student_df.loc[point_mask]
+
+# Students without coordinates are matched by name.
+name_mask = ~point_mask
+
+if point_student_df.shape[0] > 0:
+    t_start = perf_counter()
+
+    # Geometries of the rows kept in gdf, in the same order. The index of gdf is still the row number in the GADM layer.
+    geometry = read_geometry(finest_level).iloc[gdf.index.to_numpy()]
+
+    points = gpd.GeoSeries(
+        gpd.points_from_xy(point_student_df[lon_col], point_student_df[lat_col]),
+        crs = "EPSG:4326",
     )
 
-    # For each column, perform unique preprocessing steps.
-    for col in df_preprocessed.columns:
-        if col in preprocess_dct:
-            specific_func = preprocess_dct[col]
+    area_positions = points_to_areas(geometry, points)
+    inside = area_positions >= 0
+
+    point_match_df = pd.concat(
+        [
+            point_student_df.loc[inside, info_cols + out_loc_cols].reset_index(drop = True),
+            gdf.iloc[area_positions[inside]].loc[:, g_label_lst + [gid_label]].reset_index(drop = True),
+        ],
+        axis = 1,
+    )
+    point_match_df["score"] = finest_level
 
-            df_preprocessed[col] = (
-                specific_func(df_preprocessed[col])
-                .str.strip()
-            )
+    # Points outside every area (e.g., in the sea or with swapped coordinates) are matched by name instead.
+    outside_df = point_student_df.loc[~inside]
+    name_mask[np.flatnonzero(point_mask)[~inside]] = True
 
-    if comparison_filename is not None:
-        # Save a table that compares the original location data to the preprocessed version.
+    print(f"Assigned {point_match_df.shape[0]} students by coordinates in {perf_counter() - t_start} s. {outside_df.shape[0]} points are outside every area.")
 
-        # Append _preprocessed to labels
-        df_pp_copy = df_preprocessed.copy()
-        df_pp_copy.columns = [
-            label + "_preprocessed"
-            for label in df_preprocessed.columns
-        ]
+    outside_inc_df = outside_df.loc[outside_df[loc_cols].isnull().any(axis = 1)]
 
-        # Put the original columns next to the preprocessed ones.
-        df_comparison = pd.concat(
-            [df[label_lst], df_pp_copy],
-            axis = 1,
-        )
+    if outside_inc_df.shape[0] > 0:
+        outside_inc_df[["student_number"] + coord_cols].to_csv("./private/cleaning_outputs/students_outside_areas.csv", index = False)
+        raise ValueError("Some students have coordinates outside every area and incomplete location data. Check students_outside_areas.csv")
 
-        df_comparison.to_csv(f"./private/cleaning_outputs/{comparison_filename}.csv")
+else:
+    point_match_df = pd.DataFrame(columns = info_cols + out_loc_cols + match_cols)
 
-    # Only return the preprocessed data.
-    return df_preprocessed
+name_student_df = changed_student_df.loc[name_mask]
 
+# Only new or changed students are preprocessed and matched.
 student_df_pp = full_preprocess(
-    student_df,
+    name_student_df,
     ["student_number"] + s_label_lst,
     comparison_filename = "student_df_comparison",
 )
 
-gadm_df_pp = full_preprocess(
-    gdf,
-    g_label_lst,
-    comparison_filename = None,# "gadm_df_comparison",
-)
-
 print("Done preprocessing.")
 
 # %%
 # For each student location, find a match in GADM.
 
-from time import perf_counter
+from matching_engine import BlockedMatcher, match_all
+from matching_cache import MatchCache
+
+# Number of worker processes used for matching, and the number of students sent to a worker at a time.
+# Set n_workers to 1 to match on a single core.
+n_workers = os.cpu_count() or 1
+chunk_size = 500
+
+# Matches of previously seen locations are read from a cache, so only new locations are matched.
+# The cache uses cache_version from the preprocessing cell, so changing the GADM data, the preprocessing rules or the matching options starts a fresh version.
+use_cache = True
+cache_path = "./private/cleaning_outputs/match_cache.sqlite"
+cache_max_entries = 200000
 
 t_start = perf_counter()
 
-def get_ratio(s1, s2):
-    """Obtain Levenshtein ratio of two strings. Can be used in pd.Series.apply()"""
-    ratio = Levenshtein.ratio(s1, s2)
-    return ratio
+# Most students share a location with other students, so each distinct location is matched only once.
+loc_df = (
+    student_df_pp[s_label_lst]
+    .drop_duplicates()
+    .reset_index(drop = True)
+)
+
+print(f"{loc_df.shape[0]} distinct locations among {student_df_pp.shape[0]} students.")
 
-# Set student number as index.
-s_id_df = student_df.set_index(
-    "student_number",
-    # Keep the column even after making it the index
-    drop = False,
+# Row position of each GID in gdf.
+gid_positions = pd.Series(
+    np.arange(gdf.shape[0]),
+    index = gdf[gid_label].values,
 )
 
-match_rows = []
-for s_index, s_row in student_df_pp.iterrows():
-    s_id = s_row["student_number"]
-    score_dct = {}
-
-    for s_label in s_row.index:
-        if s_label in s_label_lst:
-            s_text = s_row[s_label]
-
-            g_label = label_series[s_label]
-            g_col = gadm_df_pp[g_label]
-            score_dct[g_label] = g_col.apply(get_ratio, s2 = s_text)
-
-    score_df = pd.DataFrame(score_dct)
-
-    score_df["total"] = score_df.sum(axis = 1)
-    highest_score = score_df["total"].max()
-    g_index = score_df["total"].argmax()
-
-    g_row_orig = gdf.iloc[g_index].loc[g_label_lst + [gid_label]]
-    g_row_orig["score"] = highest_score
-    s_row_orig = (
-        s_id_df
-        .loc[
-            s_id,
-            ["student_number", "strand", "grade_level", "section"] + s_label_lst
-        ]
+# Location tuples ordered from province downwards.
+locations = [tuple(row) for row in loc_df.values.tolist()]
+
+if use_cache:
+    match_cache = MatchCache(cache_path, cache_version, max_entries = cache_max_entries)
+    cached_matches = match_cache.get_many(locations)
+else:
+    cached_matches = {}
+
+# Locations that are not in the cache are matched now.
+missing_locations = [loc for loc in locations if loc not in cached_matches]
+
+print(f"{len(cached_matches)} locations found in the cache. Matching {len(missing_locations)} locations.")
+
+new_matches = {}
+
+if len(missing_locations) > 0:
+    # The GADM names are only preprocessed when some locations need matching.
+    gadm_df_pp = full_preprocess(
+        gdf,
+        g_label_lst,
+        comparison_filename = None,# "gadm_df_comparison",
+    )
+
+    matcher = BlockedMatcher(
+        gadm_df_pp,
+        g_label_lst,
+        beam_width = beam_width,
+        fallback_threshold = fallback_threshold,
+        index_path = index_path if use_index else None,
+        index_limit = index_limit,
     )
 
-    final_row = pd.concat([s_row_orig, g_row_orig], axis = 0)
-    match_rows.append(final_row)
+    match_results = match_all(
+        matcher,
+        [list(loc) for loc in missing_locations],
+        n_workers = n_workers,
+        chunk_size = chunk_size,
+    )
+
+    for loc, (g_index, score) in zip(missing_locations, match_results):
+        new_matches[loc] = (gdf[gid_label].iloc[g_index], score)
+
+if use_cache:
+    match_cache.put_many(new_matches)
+    match_cache.close()
+
+save_memo(memo_path)
+
+all_matches = {**cached_matches, **new_matches}
+
+loc_df["g_index"] = [gid_positions[all_matches[loc][0]] for loc in locations]
+loc_df["score"] = [all_matches[loc][1] for loc in locations]
+
+# Give every student the match of their location.
+student_matches = student_df_pp[s_label_lst].merge(
+    loc_df,
+    how = "left",
+    on = s_label_lst,
+)
+
+s_rows_orig = (
+    name_student_df
+    .loc[:, info_cols + out_loc_cols]
+    .reset_index(drop = True)
+)
+
+g_rows_orig = (
+    gdf
+    .iloc[student_matches["g_index"]]
+    .loc[:, g_label_lst + [gid_label]]
+    .reset_index(drop = True)
+)
+
+g_rows_orig["score"] = student_matches["score"]
+
+new_match_df = pd.concat([s_rows_orig, g_rows_orig], axis = 1)
 
 match_df = (
-    pd.DataFrame(match_rows)
+    pd.concat([kept_match_df, point_match_df, new_match_df], axis = 0)
     # Sort by score increasing so we can see what must be fixed
     .sort_values("score")
     .reset_index(drop = True)
@@ -276,12 +405,15 @@ t_elapsed = t_stop - t_start
 print("Done matching.")
 print(f"Time to match locations: {t_elapsed} s")
 
-# Save the DF of matches
+# Save the DF of matches, and the version it was made with.
 match_df.to_csv(
-    "./private/cleaning_outputs/full_matches.csv",
+    matches_path,
     index = False,
 )
 
+with open(matches_version_path, "w") as file:
+    file.write(cache_version)
+
 match_df.head()
 
 #%%